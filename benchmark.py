@@ -0,0 +1,312 @@
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+DEFAULT_MIX = "currencies=30,exchange_rate=35,exchange=25,create_rate=5,update_rate=5"
+PERCENTILES = (50, 95, 99)
+
+
+class Workload:
+    """
+    The generated data set and the requests of the benchmark mix.
+
+    Each operation returns (method, path, body or None). create_rate takes
+    pairs that do not exist yet from a shared iterator, so every POST creates
+    a rate instead of answering 409.
+    """
+
+    def __init__(self, currencies=150, rates=3000, seed=1):
+        rng = random.Random(seed)
+        self.codes = [
+            "".join(letters) for letters in itertools.islice(itertools.product(string.ascii_uppercase, repeat=3), currencies)
+        ]
+        all_pairs = [(base, target) for base in self.codes for target in self.codes if base != target]
+        rng.shuffle(all_pairs)
+        rates = min(rates, len(all_pairs))
+        self.pairs = all_pairs[:rates]
+        self.rates = [round(rng.uniform(0.01, 100), 6) for _ in self.pairs]
+        self._free_pairs = iter(all_pairs[rates:])
+        self._free_lock = threading.Lock()
+
+    def create_database(self, path):
+        from database_setup import DatabaseCreator
+        from models.currency_dao import CurrencyDAO
+        from models.db import DB
+        from models.exchange_rates_dao import ExchangeRatesDAO
+
+        DatabaseCreator(path).create_schema()
+        db = DB(path)
+        try:
+            currency_dao = CurrencyDAO(db)
+            ids = {code: currency_dao.insert(code, f"Currency {code}", code[0]) for code in self.codes}
+            ExchangeRatesDAO(db).upsert_many(
+                (ids[base], ids[target], rate) for (base, target), rate in zip(self.pairs, self.rates)
+            )
+        finally:
+            db.close()
+
+    def currencies(self, rng):
+        return "GET", "/currencies", None
+
+    def exchange_rate(self, rng):
+        base, target = rng.choice(self.pairs)
+        return "GET", f"/exchangeRate/{base}{target}", None
+
+    def exchange(self, rng):
+        base, target = rng.sample(self.codes, 2)
+        return "GET", f"/exchange?from={base}&to={target}&amount={rng.randint(1, 1000)}", None
+
+    def create_rate(self, rng):
+        with self._free_lock:
+            pair = next(self._free_pairs, None)
+        if pair is None:
+            return self.update_rate(rng)
+        body = urllib.parse.urlencode({
+            "baseCurrencyCode": pair[0], "targetCurrencyCode": pair[1], "rate": round(rng.uniform(0.01, 100), 6)
+        })
+        return "POST", "/exchangeRates", body
+
+    def update_rate(self, rng):
+        base, target = rng.choice(self.pairs)
+        return "PATCH", f"/exchangeRate/{base}{target}", urllib.parse.urlencode({"rate": round(rng.uniform(0.01, 100), 6)})
+
+    operations = ("currencies", "exchange_rate", "exchange", "create_rate", "update_rate")
+
+
+def parse_mix(text):
+    """
+    Parses "currencies=30,exchange=70" into {"currencies": 30.0, "exchange": 70.0}
+    """
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in Workload.operations:
+            raise ValueError(f"unknown operation '{name}', expected one of {', '.join(Workload.operations)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise ValueError(f"invalid weight for '{name}'") from None
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("the mix needs at least one positive weight")
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(-(-pct * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, duration):
+    """
+    Turns {operation: [(seconds, ok), ...]} into the per-endpoint report
+    """
+    endpoints = {}
+    total = 0
+    for name, results in sorted(samples.items()):
+        latencies = sorted(seconds for seconds, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+        total += len(results)
+        report = {
+            "requests": len(results),
+            "errors": errors,
+            "throughput": round(len(results) / duration, 1),
+        }
+        for pct in PERCENTILES:
+            value = percentile(latencies, pct)
+            report[f"p{pct}_ms"] = None if value is None else round(value * 1000, 3)
+        endpoints[name] = report
+    return {"duration": round(duration, 3), "throughput": round(total / duration, 1), "endpoints": endpoints}
+
+
+def compare(results, baseline, latency_tolerance=0.25, throughput_tolerance=0.2):
+    """
+    Lists the regressions of results against baseline: failed requests, a
+    percentile more than latency_tolerance slower, or a throughput more than
+    throughput_tolerance lower. Endpoints missing from either side are skipped.
+    """
+    regressions = []
+    for name, current in results["endpoints"].items():
+        if current["errors"]:
+            regressions.append(f"{name}: {current['errors']} of {current['requests']} requests failed")
+        expected = baseline.get("endpoints", {}).get(name)
+        if expected is None:
+            continue
+        for pct in PERCENTILES:
+            key = f"p{pct}_ms"
+            if current.get(key) is None or expected.get(key) is None:
+                continue
+            limit = expected[key] * (1 + latency_tolerance)
+            if current[key] > limit:
+                regressions.append(f"{name}: {key} {current[key]:.3f} > {limit:.3f} (baseline {expected[key]:.3f})")
+        limit = expected["throughput"] * (1 - throughput_tolerance)
+        if current["throughput"] < limit:
+            regressions.append(
+                f"{name}: throughput {current['throughput']:.1f}/s < {limit:.1f}/s (baseline {expected['throughput']:.1f}/s)"
+            )
+    if "throughput" in baseline:
+        limit = baseline["throughput"] * (1 - throughput_tolerance)
+        if results["throughput"] < limit:
+            regressions.append(
+                f"total: throughput {results['throughput']:.1f}/s < {limit:.1f}/s (baseline {baseline['throughput']:.1f}/s)"
+            )
+    return regressions
+
+
+def start_server(db_path, workers, queue_size):
+    """
+    Serves a myServer App on db_path on an ephemeral port from a background
+    thread. Returns (httpd, port).
+    """
+    import myServer
+
+    class QuietHandler(myServer.MyServer):
+        def log_message(self, format, *args):
+            pass
+
+    httpd = myServer.make_server(myServer.App(db_path), ("127.0.0.1", 0), workers, queue_size,
+                                 handler_class=QuietHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, httpd.server_address[1]
+
+
+def drive(port, workload, mix, clients, duration, warmup, seed):
+    """
+    Runs `clients` keep-alive connections against the server for warmup +
+    duration seconds and returns the samples taken after the warmup
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = [{name: [] for name in names} for _ in range(clients)]
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+    barrier = threading.Barrier(clients)
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        own = samples[index]
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        barrier.wait()
+        try:
+            while True:
+                name = rng.choices(names, weights)[0]
+                method, path, body = getattr(workload, name)(rng)
+                headers = {"Content-Type": "application/x-www-form-urlencoded"} if body is not None else {}
+                sent = time.perf_counter()
+                if sent >= stop_at:
+                    return
+                try:
+                    conn.request(method, path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    ok = response.status < 400
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    ok = False
+                if sent >= measure_from:
+                    own[name].append((time.perf_counter() - sent, ok))
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = {name: [] for name in names}
+    for own in samples:
+        for name, results in own.items():
+            merged[name].extend(results)
+    return merged
+
+
+def print_report(results, out=sys.stdout):
+    print(f"{'endpoint':<15}{'requests':>10}{'errors':>8}{'req/s':>10}" +
+          "".join(f"{f'p{pct} ms':>10}" for pct in PERCENTILES), file=out)
+    for name, report in results["endpoints"].items():
+        print(f"{name:<15}{report['requests']:>10}{report['errors']:>8}{report['throughput']:>10.1f}" +
+              "".join(f"{report[f'p{pct}_ms'] or 0:>10.2f}" for pct in PERCENTILES), file=out)
+    print(f"total {results['throughput']:.1f} req/s over {results['duration']:.1f}s", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the API server in-process against a generated database")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"operation=weight list out of {', '.join(Workload.operations)} (default: %(default)s)")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds of load before measuring")
+    parser.add_argument("--currencies", type=int, default=150, help="currencies in the generated database")
+    parser.add_argument("--rates", type=int, default=3000, help="exchange rates in the generated database")
+    parser.add_argument("--workers", type=int, default=8, help="server worker threads")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the data and of the request sequence")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the results")
+    parser.add_argument("--baseline", default="benchmark_baseline.json",
+                        help="results to compare against; the comparison is skipped if the file does not exist")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25,
+                        help="allowed relative growth of p50/p95/p99 (default: %(default)s)")
+    parser.add_argument("--throughput-tolerance", type=float, default=0.2,
+                        help="allowed relative drop of throughput (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    workload = Workload(currencies=args.currencies, rates=args.rates, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "benchmark.db")
+        workload.create_database(db_path)
+        httpd, port = start_server(db_path, args.workers, queue_size=max(64, args.clients * 2))
+        try:
+            samples = drive(port, workload, mix, args.clients, args.duration, args.warmup, args.seed)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            httpd.app.close()
+
+    results = summarize(samples, args.duration)
+    results["config"] = {
+        "mix": mix, "clients": args.clients, "workers": args.workers,
+        "currencies": args.currencies, "rates": args.rates, "seed": args.seed,
+    }
+    print_report(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, nothing to compare")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != results["config"]:
+        print("warning: the baseline was taken with a different configuration", file=sys.stderr)
+    regressions = compare(results, baseline, args.latency_tolerance, args.throughput_tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,68 +1,93 @@
 import json
 import urllib.parse
+from controllers.serializers import currencies_to_json, currency_to_json
 from models.currency_dao import CurrencyDAO
+from server.compression import send_body
+from server.conditional import make_etag, send_not_modified_if_fresh, send_validators
+from server.params import next_page_link, parse_codes, parse_page
+from server.response_cache import ResponseCache
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 class CurrencyController:
     """
     Controller class for Currency table
     """
 
-    def __init__(self, curr_dao: CurrencyDAO):
+    def __init__(self, curr_dao: CurrencyDAO, response_cache: ResponseCache):
         self._currency_dao = curr_dao
+        self._response_cache = response_cache
 
-    def handle_get_currencies(self, handler):
+    def handle_get_currencies(self, handler, path_params, query_params):
+        """
+        All currencies, or a keyset page of them: /currencies?limit=&after={id}&codes=USD,EUR
+        A full page carries a Link header to the next one
+        """
         try:
-            currencies = self._currency_dao.get_all_currencies()
-            formatted_currencies = []
-            for currency in currencies:
-                formatted_currencies.append({
-                    "id": currency["id"],
-                    "name": currency["fullname"],  
-                    "code": currency["code"],
-                    "sign": currency["sign"]
-                })
+            paged = any(name in query_params for name in ('limit', 'after', 'codes'))
+            if paged:
+                try:
+                    limit, after = parse_page(query_params, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+                    codes = parse_codes(query_params, 'codes')
+                except ValueError as e:
+                    self._send_error_response(handler, 400, str(e))
+                    return
+
+            token, last_modified = self._currency_dao.version()
+            etag = make_etag(token)
+            if send_not_modified_if_fresh(handler, etag, last_modified):
+                return
+
+            next_link = None
+            if paged:
+                # One extra row tells whether there is a next page
+                currencies = self._currency_dao.get_currencies_page(after, limit + 1, codes)
+                if len(currencies) > limit:
+                    currencies = currencies[:limit]
+                    next_link = next_page_link(handler.path.split("?")[0], query_params, currencies[-1].id)
+                body = currencies_to_json(currencies)
+            else:
+                body = self._response_cache.get_or_build(
+                    ("currencies",),
+                    lambda: (currencies_to_json(self._currency_dao.get_all_currencies()), {"currencies"})
+                )
             
             handler.send_response(200)
             handler.send_header("Content-Type", "application/json; charset=utf-8")
+            send_validators(handler, etag, last_modified)
+            if next_link:
+                handler.send_header("Link", next_link)
             handler.send_header("Access-Control-Allow-Origin", "*")
             handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
             handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-            handler.end_headers()
-            handler.wfile.write(json.dumps(formatted_currencies, ensure_ascii=False).encode('utf-8'))
+            send_body(handler, body)
         except Exception as e:
             self._send_error_response(handler, 500, "Database error")
 
-    def handle_get_currency_by_code(self, handler):
+    def handle_get_currency_by_code(self, handler, path_params, query_params):
         try:
-            path_parts = handler.path.split("/")
-            if len(path_parts) < 3 or not path_parts[-1]:
+            if not path_params.get("code"):
                 self._send_error_response(handler, 400, "Currency code is missing")
                 return
             
-            curr_code = path_parts[-1].upper()
+            curr_code = path_params["code"].upper()
             
             currency = self._currency_dao.get_currency_by_code(curr_code)
             if currency:
-                formatted_currency = {
-                    "id": currency["id"],
-                    "name": currency["fullname"],  
-                    "code": currency["code"],
-                    "sign": currency["sign"]
-                }
-                
+                body = currency_to_json(currency).encode('utf-8')
                 handler.send_response(200)
                 handler.send_header("Content-Type", "application/json; charset=utf-8")
                 handler.send_header("Access-Control-Allow-Origin", "*")
                 handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
                 handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-                handler.end_headers()
-                handler.wfile.write(json.dumps(formatted_currency, ensure_ascii=False).encode('utf-8'))
+                send_body(handler, body)
             else:
                 self._send_error_response(handler, 404, "Currency not found")
         except Exception as e:
             self._send_error_response(handler, 500, "Database error")
 
-    def handle_post_currencies(self, handler):
+    def handle_post_currencies(self, handler, path_params, query_params):
         try:
             content_length = int(handler.headers.get('Content-Length', 0))
             if content_length == 0:
@@ -96,13 +121,13 @@ class CurrencyController:
                 "sign": sign
             }
             
+            body = json.dumps(new_currency, ensure_ascii=False).encode('utf-8')
             handler.send_response(201)
             handler.send_header("Content-Type", "application/json; charset=utf-8")
             handler.send_header("Access-Control-Allow-Origin", "*")
             handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
             handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-            handler.end_headers()
-            handler.wfile.write(json.dumps(new_currency, ensure_ascii=False).encode('utf-8'))
+            send_body(handler, body)
             
         except ValueError as e:
             if "already exists" in str(e):
@@ -114,11 +139,11 @@ class CurrencyController:
 
     def _send_error_response(self, handler, status_code, message):
         error_response = {"message": message}
+        body = json.dumps(error_response, ensure_ascii=False).encode('utf-8')
         handler.send_response(status_code)
         handler.send_header("Content-Type", "application/json; charset=utf-8")
         handler.send_header("Access-Control-Allow-Origin", "*")
         handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
         handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        handler.end_headers()
-        handler.wfile.write(json.dumps(error_response, ensure_ascii=False).encode('utf-8'))
+        send_body(handler, body)
         
\ No newline at end of file
@@ -1,34 +1,46 @@
 import json
-import urllib.parse
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from controllers.serializers import currency_to_dict
 from models.currency_dao import CurrencyDAO
 from models.exchange_rates_dao import ExchangeRatesDAO
+from models.rate_graph import RateGraph
+from server.compression import send_body
+from server.conditional import make_etag, send_not_modified_if_fresh, send_validators
+from server.params import parse_timestamp
+from server.response_cache import ResponseCache
+
+MAX_BATCH_ITEMS = 100000
+CENT = Decimal('0.01')
+
+
+def _round_cents(value: Decimal) -> Decimal:
+    """Rounds to cents; raises InvalidOperation if that needs more digits than the context has"""
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
 
 class ExchangeController:
 
-    def __init__(self, currency_dao: CurrencyDAO, exchange_rates_dao: ExchangeRatesDAO):
+    def __init__(self, currency_dao: CurrencyDAO, exchange_rates_dao: ExchangeRatesDAO, rate_graph: RateGraph,
+                 response_cache: ResponseCache):
         self._currency_dao = currency_dao
         self._exchange_rates_dao = exchange_rates_dao
+        self._rate_graph = rate_graph
+        self._response_cache = response_cache
 
     def _send_error_response(self, handler, status_code, message):
         """Отправка ошибки в формате JSON"""
         error_response = {"message": message}
+        body = json.dumps(error_response, ensure_ascii=False).encode('utf-8')
         handler.send_response(status_code)
         handler.send_header("Content-Type", "application/json; charset=utf-8")
         handler.send_header("Access-Control-Allow-Origin", "*")
         handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
         handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        handler.end_headers()
-        handler.wfile.write(json.dumps(error_response, ensure_ascii=False).encode('utf-8'))
+        send_body(handler, body)
 
-    def handle_exchange(self, handler):
+    def handle_exchange(self, handler, path_params, query_params):
         """Calculation of the transfer of a certain amount of funds from one currency to another"""
         try:
-            
-            parsed_url = urllib.parse.urlparse(handler.path)
-            query_params = urllib.parse.parse_qs(parsed_url.query)
-            
-            
             required_params = ['from', 'to', 'amount']
             for param in required_params:
                 if param not in query_params or not query_params[param][0].strip():
@@ -42,13 +54,21 @@ class ExchangeController:
             
             try:
                 amount = Decimal(amount_str)
-                if amount <= 0:
+                if not amount.is_finite() or amount <= 0:
                     raise ValueError("Amount must be positive")
-            except (ValueError, TypeError):
+            except (ValueError, TypeError, InvalidOperation):
                 self._send_error_response(handler, 400, "Invalid amount value")
                 return
             
             
+            at = None
+            if 'at' in query_params:
+                try:
+                    at = parse_timestamp(query_params['at'][0])
+                except ValueError:
+                    self._send_error_response(handler, 400, "Invalid 'at' timestamp")
+                    return
+            
             from_currency = self._currency_dao.get_currency_by_code(from_code)
             to_currency = self._currency_dao.get_currency_by_code(to_code)
             
@@ -60,93 +80,202 @@ class ExchangeController:
                 return
             
             
-            exchange_rate = self._get_exchange_rate(from_currency["id"], to_currency["id"])
+            if at is None:
+                exchange_rate = self._get_exchange_rate(from_currency.id, to_currency.id)
+            else:
+                exchange_rate = self._rate_graph.get_rate_at(from_currency.id, to_currency.id, at)
             
             if exchange_rate is None:
                 self._send_error_response(handler, 404, "Exchange rate not found")
                 return
             
             
-            converted_amount = amount * Decimal(str(exchange_rate))
-            
-            
-            converted_amount = converted_amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            amount = amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            try:
+                converted_amount = _round_cents(amount * Decimal(str(exchange_rate)))
+                amount = _round_cents(amount)
+            except InvalidOperation:
+                self._send_error_response(handler, 400, "Invalid amount value")
+                return
             
             
             response = {
-                "baseCurrency": {
-                    "id": from_currency["id"],
-                    "name": from_currency["fullname"],
-                    "code": from_currency["code"],
-                    "sign": from_currency["sign"]
-                },
-                "targetCurrency": {
-                    "id": to_currency["id"],
-                    "name": to_currency["fullname"],
-                    "code": to_currency["code"],
-                    "sign": to_currency["sign"]
-                },
+                "baseCurrency": currency_to_dict(from_currency),
+                "targetCurrency": currency_to_dict(to_currency),
                 "rate": float(exchange_rate),
                 "amount": float(amount),
                 "convertedAmount": float(converted_amount)
             }
             
+            body = json.dumps(response, ensure_ascii=False).encode('utf-8')
             handler.send_response(200)
             handler.send_header("Content-Type", "application/json; charset=utf-8")
             handler.send_header("Access-Control-Allow-Origin", "*")
             handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
             handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-            handler.end_headers()
-            handler.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+            send_body(handler, body)
             
         except Exception as e:
             self._send_error_response(handler, 500, "Server error")
 
+    def handle_exchange_batch(self, handler, path_params, query_params):
+        """
+        Converts a JSON array of {"from", "to", "amount"} items in one request.
+        Each item is validated and converted on its own, with the same rounding
+        as handle_exchange; currency and rate lookups are shared by the items of a pair.
+        Invalid items get {"message", "status"} in their place in the result.
+        """
+        try:
+            content_length = int(handler.headers.get('Content-Length', 0))
+            if content_length == 0:
+                self._send_error_response(handler, 400, "Request body is required")
+                return
+
+            try:
+                items = json.loads(handler.rfile.read(content_length).decode('utf-8'), parse_float=Decimal)
+            except (ValueError, UnicodeDecodeError):
+                self._send_error_response(handler, 400, "Request body must be valid JSON")
+                return
+            if not isinstance(items, list):
+                self._send_error_response(handler, 400, "Request body must be a JSON array")
+                return
+            if len(items) > MAX_BATCH_ITEMS:
+                self._send_error_response(handler, 400, f"Batch is limited to {MAX_BATCH_ITEMS} items")
+                return
+
+            results = [None] * len(items)
+            pairs = {}
+            for index, item in enumerate(items):
+                if not isinstance(item, dict):
+                    results[index] = {"message": "Item must be an object", "status": 400}
+                    continue
+                missing = [param for param in ('from', 'to', 'amount') if not str(item.get(param, '')).strip()]
+                if missing:
+                    results[index] = {"message": f"Required parameter '{missing[0]}' is missing", "status": 400}
+                    continue
+                try:
+                    amount = Decimal(str(item['amount']).strip())
+                    if not amount.is_finite() or amount <= 0:
+                        raise ValueError("Amount must be positive")
+                    rounded_amount = _round_cents(amount)
+                except (ValueError, TypeError, InvalidOperation):
+                    results[index] = {"message": "Invalid amount value", "status": 400}
+                    continue
+                pair = (str(item['from']).strip().upper(), str(item['to']).strip().upper())
+                pairs.setdefault(pair, ([], []))
+                pairs[pair][0].append(index)
+                pairs[pair][1].append((amount, rounded_amount))
+
+            formatted_currencies = {}
+            for (from_code, to_code), (indexes, amounts) in pairs.items():
+                from_currency = self._currency_dao.get_currency_by_code(from_code)
+                to_currency = self._currency_dao.get_currency_by_code(to_code)
+                if not from_currency or not to_currency:
+                    missing_code = to_code if from_currency else from_code
+                    error = {"message": f"Currency '{missing_code}' not found", "status": 404}
+                    for index in indexes:
+                        results[index] = error
+                    continue
+
+                exchange_rate = self._get_exchange_rate(from_currency.id, to_currency.id)
+                if exchange_rate is None:
+                    error = {"message": "Exchange rate not found", "status": 404}
+                    for index in indexes:
+                        results[index] = error
+                    continue
+
+                for currency in (from_currency, to_currency):
+                    if currency.code not in formatted_currencies:
+                        formatted_currencies[currency.code] = currency_to_dict(currency)
+                base_currency = formatted_currencies[from_code]
+                target_currency = formatted_currencies[to_code]
+                rate = float(exchange_rate)
+                decimal_rate = Decimal(str(exchange_rate))
+                for index, (amount, rounded_amount) in zip(indexes, amounts):
+                    try:
+                        converted_amount = _round_cents(amount * decimal_rate)
+                    except InvalidOperation:
+                        results[index] = {"message": "Invalid amount value", "status": 400}
+                        continue
+                    results[index] = {
+                        "baseCurrency": base_currency,
+                        "targetCurrency": target_currency,
+                        "rate": rate,
+                        "amount": float(rounded_amount),
+                        "convertedAmount": float(converted_amount)
+                    }
+
+            body = json.dumps(results, ensure_ascii=False).encode('utf-8')
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json; charset=utf-8")
+            handler.send_header("Access-Control-Allow-Origin", "*")
+            handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
+            handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+            send_body(handler, body)
+
+        except Exception as e:
+            self._send_error_response(handler, 500, "Server error")
+
+    def handle_get_exchange_matrix(self, handler, path_params, query_params):
+        """
+        Cross rates between every pair of currencies (or of the ?codes=USD,EUR,... subset):
+        {"currencies": [codes], "rates": [[rate from currencies[i] to currencies[j], or null]]}
+        The serialized matrix is kept in the response cache until the next rate change.
+        """
+        try:
+            if 'codes' in query_params:
+                codes = []
+                for code in query_params['codes'][0].split(','):
+                    code = code.strip().upper()
+                    if code and code not in codes:
+                        codes.append(code)
+                if not codes:
+                    self._send_error_response(handler, 400, "Parameter 'codes' is empty")
+                    return
+                currencies = []
+                for code in codes:
+                    currency = self._currency_dao.get_currency_by_code(code)
+                    if not currency:
+                        self._send_error_response(handler, 404, f"Currency '{code}' not found")
+                        return
+                    currencies.append(currency)
+            else:
+                currencies = self._currency_dao.get_all_currencies()
+
+            ids = tuple(currency.id for currency in currencies)
+            codes = [currency.code for currency in currencies]
+
+            token, last_modified = self._exchange_rates_dao.version()
+            etag = make_etag(token)
+            if send_not_modified_if_fresh(handler, etag, last_modified):
+                return
+
+            def build_matrix():
+                rows = []
+                for from_id in ids:
+                    rates_from = self._rate_graph.get_rates_from(from_id)
+                    rows.append([rates_from.get(to_id) for to_id in ids])
+                matrix = {"currencies": codes, "rates": rows}
+                # Without ?codes= a new currency adds a row and a column
+                deps = {"rates"} if 'codes' in query_params else {"rates", "currencies"}
+                return json.dumps(matrix, ensure_ascii=False).encode('utf-8'), deps
+
+            body = self._response_cache.get_or_build(("matrix",) + ids, build_matrix)
+
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json; charset=utf-8")
+            send_validators(handler, etag, last_modified)
+            handler.send_header("Access-Control-Allow-Origin", "*")
+            handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
+            handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+            send_body(handler, body)
+
+        except Exception as e:
+            self._send_error_response(handler, 500, "Server error")
+
     def _get_exchange_rate(self, from_id: int, to_id: int):
         """
-        Getting the exchange rate in one of three scenarios:
-        1. Direct rate A -> B
-        2. Reverse rate B -> A (take 1/rate)
-        3. Cross rate via USD (USD -> A and USD -> B, calculate A -> B)
+        Getting the exchange rate from the rate graph:
+        direct rate A -> B, reverse rate B -> A (1/rate) or a cross rate
+        through the shortest chain of known pairs, e.g. EUR -> GBP -> JPY
         """
-        
-        direct_rate = self._exchange_rates_dao.get_exchange_rate(from_id, to_id)
-        if direct_rate:
-            return direct_rate["rate"]
-        
-        reverse_rate = self._exchange_rates_dao.get_exchange_rate(to_id, from_id)
-        if reverse_rate:
-            return 1.0 / reverse_rate["rate"]
-        
-        usd_currency = self._currency_dao.get_currency_by_code("USD")
-        if not usd_currency:
-            return None
-        
-        usd_id = usd_currency["id"]
-        
-        if from_id == usd_id or to_id == usd_id:
-            return None
-        
-        usd_to_from = self._exchange_rates_dao.get_exchange_rate(usd_id, from_id)
-        usd_to_to = self._exchange_rates_dao.get_exchange_rate(usd_id, to_id)
-        
-        if usd_to_from and usd_to_to:
-            return usd_to_to["rate"] / usd_to_from["rate"]
-        
-        from_to_usd = self._exchange_rates_dao.get_exchange_rate(from_id, usd_id)
-        to_to_usd = self._exchange_rates_dao.get_exchange_rate(to_id, usd_id)
-        
-        if from_to_usd and to_to_usd:
-            # from -> USD, to -> USD => from -> to = (from -> USD) / (to -> USD)
-            return from_to_usd["rate"] / to_to_usd["rate"]
-        
-        if from_to_usd and usd_to_to:
-            return from_to_usd["rate"] * usd_to_to["rate"]
-        
-        if usd_to_from and to_to_usd:
-            return (1.0 / usd_to_from["rate"]) * (1.0 / to_to_usd["rate"])
-        
-        return None
-
-    
\ No newline at end of file
+        return self._rate_graph.get_rate(from_id, to_id)
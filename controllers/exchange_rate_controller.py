@@ -1,80 +1,187 @@
 import json
+import math
 import urllib.parse
-from models.exchange_rates_dao import ExchangeRatesDAO
+from controllers.serializers import currency_to_dict, exchange_rate_to_json, exchange_rates_to_json
+from models.exchange_rates_dao import CANDLE_INTERVALS, ExchangeRatesDAO
 from models.currency_dao import CurrencyDAO
+from server.compression import send_body
+from server.conditional import make_etag, send_not_modified_if_fresh, send_validators
+from server.response_cache import ResponseCache
+from server.params import format_timestamp, next_page_link, parse_codes, parse_page, parse_timestamp
+from server.sse import RateStream
+
+MAX_BULK_ROWS = 10000
+MAX_HISTORY_ROWS = 10000
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 class ExchangeRateController:
     """
     Controller for ExchangeRates table
     """
-    def __init__(self, exchange_rates_dao: ExchangeRatesDAO, currency_dao: CurrencyDAO):
+    def __init__(self, exchange_rates_dao: ExchangeRatesDAO, currency_dao: CurrencyDAO,
+                 response_cache: ResponseCache, rate_stream: RateStream):
         self._exchange_rates_dao = exchange_rates_dao
         self._currency_dao = currency_dao
+        self._response_cache = response_cache
+        self._rate_stream = rate_stream
 
-    def handle_get_exchange_rates(self, handler):
+    def handle_get_exchange_rates(self, handler, path_params, query_params):
+        """
+        All rates, or a keyset page of them: /exchangeRates?limit=&after={id}
+        filtered with base=USD,EUR / target=... / codes=... (both sides in the list).
+        A full page carries a Link header to the next one
+        """
         try:
-            exchange_rates = self._exchange_rates_dao.get_all()
-            
-            if not exchange_rates:
-                handler.send_response(200)
-                handler.send_header("Content-Type", "application/json; charset=utf-8")
-                handler.send_header("Access-Control-Allow-Origin", "*")
-                handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
-                handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-                handler.end_headers()
-                handler.wfile.write(json.dumps([], ensure_ascii=False).encode('utf-8'))
+            paged = any(name in query_params for name in ('limit', 'after', 'base', 'target', 'codes'))
+            if paged:
+                try:
+                    limit, after = parse_page(query_params, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+                    base_codes = parse_codes(query_params, 'base')
+                    target_codes = parse_codes(query_params, 'target')
+                    codes = parse_codes(query_params, 'codes')
+                except ValueError as e:
+                    self._send_error_response(handler, 400, str(e))
+                    return
+                if codes is not None:
+                    base_codes = codes if base_codes is None else base_codes & codes
+                    target_codes = codes if target_codes is None else target_codes & codes
+                filter_ids = []
+                for filter_codes in (base_codes, target_codes):
+                    if filter_codes is None:
+                        filter_ids.append(None)
+                        continue
+                    ids = []
+                    for code in sorted(filter_codes):
+                        currency = self._currency_dao.get_currency_by_code(code)
+                        if not currency:
+                            self._send_error_response(handler, 404, f"Currency '{code}' not found")
+                            return
+                        ids.append(currency.id)
+                    filter_ids.append(ids)
+
+            token, last_modified = self._exchange_rates_dao.version()
+            etag = make_etag(token)
+            if send_not_modified_if_fresh(handler, etag, last_modified):
                 return
 
-            formatted_rates = []
-            for rate in exchange_rates:
-                base_currency = self._currency_dao.get_currency_by_id(rate['base_currency_id'])
-                target_currency = self._currency_dao.get_currency_by_id(rate['target_currency_id'])
-                
-                if base_currency and target_currency:
-                    formatted_rate = {
-                        "id": rate["id"],
-                        "baseCurrency": {
-                            "id": base_currency["id"],
-                            "name": base_currency["fullname"],
-                            "code": base_currency["code"],
-                            "sign": base_currency["sign"]
-                        },
-                        "targetCurrency": {
-                            "id": target_currency["id"],
-                            "name": target_currency["fullname"],
-                            "code": target_currency["code"],
-                            "sign": target_currency["sign"]
-                        },
-                        "rate": rate["rate"]
-                    }
-                    formatted_rates.append(formatted_rate)
+            def format_rates(exchange_rates):
+                deps = {"rates"}
+                for rate in exchange_rates:
+                    deps.add(("currency", rate.base_currency.code))
+                    deps.add(("currency", rate.target_currency.code))
+                return exchange_rates_to_json(exchange_rates), deps
+
+            next_link = None
+            if paged:
+                # One extra row tells whether there is a next page
+                exchange_rates = self._exchange_rates_dao.get_page_with_currencies(
+                    after, limit + 1, filter_ids[0], filter_ids[1]
+                )
+                if len(exchange_rates) > limit:
+                    exchange_rates = exchange_rates[:limit]
+                    next_link = next_page_link(handler.path.split("?")[0], query_params, exchange_rates[-1].id)
+                body, _ = format_rates(exchange_rates)
+            else:
+                body = self._response_cache.get_or_build(
+                    ("rates",), lambda: format_rates(self._exchange_rates_dao.get_all_with_currencies())
+                )
 
             handler.send_response(200)
             handler.send_header("Content-Type", "application/json; charset=utf-8")
+            send_validators(handler, etag, last_modified)
+            if next_link:
+                handler.send_header("Link", next_link)
             handler.send_header("Access-Control-Allow-Origin", "*")
             handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
             handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-            handler.end_headers()
-            handler.wfile.write(json.dumps(formatted_rates, ensure_ascii=False).encode('utf-8'))
+            send_body(handler, body)
         except Exception as e:
             print(f"Error in handle_get_exchange_rates: {e}")  # Добавили логирование
             self._send_error_response(handler, 500, "Database error")
 
-    def handle_get_exchange_rate_by_codes(self, handler):
+    def handle_get_exchange_rate_by_codes(self, handler, path_params, query_params):
         try:
-            path = handler.path
-            path_parts = path.split("/")
-            if len(path_parts) < 3 or not path_parts[-1]:
-                self._send_error_response(handler, 400, "Currency pair codes are missing")
+            if "base" not in path_params:
+                if path_params.get("pair"):
+                    self._send_error_response(handler, 400, "Invalid currency pair format")
+                else:
+                    self._send_error_response(handler, 400, "Currency pair codes are missing")
+                return
+                
+            base_code = path_params["base"].upper()
+            target_code = path_params["target"].upper()
+            
+            base_currency = self._currency_dao.get_currency_by_code(base_code)
+            target_currency = self._currency_dao.get_currency_by_code(target_code)
+            
+            if not base_currency or not target_currency:
+                self._send_error_response(handler, 404, "Currency not found")
+                return
+            
+            token, last_modified = self._exchange_rates_dao.version()
+            etag = make_etag(token)
+            if send_not_modified_if_fresh(handler, etag, last_modified):
+                return
+            
+            def build_body():
+                exchange_rate = self._exchange_rates_dao.get_exchange_rate(
+                    base_currency.id, target_currency.id
+                )
+                if not exchange_rate:
+                    return None
+
+                body = exchange_rate_to_json(exchange_rate.id, base_currency, target_currency, exchange_rate.rate)
+                deps = {
+                    ("rate", base_currency.id, target_currency.id),
+                    ("currency", base_currency.code),
+                    ("currency", target_currency.code)
+                }
+                return body.encode('utf-8'), deps
+
+            body = self._response_cache.get_or_build(
+                ("rate", base_currency.id, target_currency.id), build_body
+            )
+            if body is None:
+                self._send_error_response(handler, 404, "Exchange rate not found")
                 return
             
-            currency_pair = path_parts[-1].upper()
-            if len(currency_pair) != 6:
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json; charset=utf-8")
+            send_validators(handler, etag, last_modified)
+            handler.send_header("Access-Control-Allow-Origin", "*")
+            handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
+            handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+            send_body(handler, body)
+            
+        except Exception as e:
+            self._send_error_response(handler, 500, "Database error")
+
+    def handle_get_exchange_rate_history(self, handler, path_params, query_params):
+        """
+        Rate changes of a pair: /exchangeRate/{pair}/history?from=&to=&limit=
+        from/to are unix seconds or ISO 8601 and default to the whole history
+        """
+        try:
+            if "base" not in path_params:
                 self._send_error_response(handler, 400, "Invalid currency pair format")
                 return
-                
-            base_code = currency_pair[:3]
-            target_code = currency_pair[3:]
+            base_code = path_params["base"].upper()
+            target_code = path_params["target"].upper()
+            
+            try:
+                from_at = parse_timestamp(query_params['from'][0]) if 'from' in query_params else 0.0
+                to_at = parse_timestamp(query_params['to'][0]) if 'to' in query_params else float("inf")
+            except ValueError:
+                self._send_error_response(handler, 400, "Invalid 'from' or 'to' timestamp")
+                return
+            try:
+                limit = int(query_params['limit'][0]) if 'limit' in query_params else 1000
+                if not 0 < limit <= MAX_HISTORY_ROWS:
+                    raise ValueError("limit out of range")
+            except ValueError:
+                self._send_error_response(handler, 400, f"Parameter 'limit' must be between 1 and {MAX_HISTORY_ROWS}")
+                return
             
             base_currency = self._currency_dao.get_currency_by_code(base_code)
             target_currency = self._currency_dao.get_currency_by_code(target_code)
@@ -83,43 +190,133 @@ class ExchangeRateController:
                 self._send_error_response(handler, 404, "Currency not found")
                 return
             
-            exchange_rate = self._exchange_rates_dao.get_exchange_rate(
-                base_currency["id"], target_currency["id"]
+            history = self._exchange_rates_dao.get_history(
+                base_currency.id, target_currency.id, from_at, to_at, limit
             )
             
-            if not exchange_rate:
-                self._send_error_response(handler, 404, "Exchange rate not found")
+            response = {
+                "baseCurrency": currency_to_dict(base_currency),
+                "targetCurrency": currency_to_dict(target_currency),
+                "history": [
+                    {"rate": change["rate"], "timestamp": format_timestamp(change["changed_at"])}
+                    for change in history
+                ]
+            }
+            
+            body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json; charset=utf-8")
+            handler.send_header("Access-Control-Allow-Origin", "*")
+            handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
+            handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+            send_body(handler, body)
+            
+        except Exception as e:
+            self._send_error_response(handler, 500, "Database error")
+
+    def handle_stream_rates(self, handler, path_params, query_params):
+        """
+        Server-Sent Events stream of rate changes: /stream/rates?pairs=USDEUR,USDRUB
+        Without pairs every change is sent
+        """
+        try:
+            pairs = None
+            if 'pairs' in query_params:
+                pairs = set()
+                for pair in query_params['pairs'][0].split(","):
+                    pair = pair.strip().upper()
+                    if len(pair) != 6:
+                        self._send_error_response(handler, 400, f"Invalid currency pair '{pair}'")
+                        return
+                    if not self._currency_dao.get_currency_by_code(pair[:3]) or \
+                            not self._currency_dao.get_currency_by_code(pair[3:]):
+                        self._send_error_response(handler, 404, f"Currency not found in pair '{pair}'")
+                        return
+                    pairs.add(pair)
+            
+            last_event_id = handler.headers.get('Last-Event-ID')
+            try:
+                last_event_id = int(last_event_id) if last_event_id else None
+            except ValueError:
+                last_event_id = None
+            
+            if not self._rate_stream.subscribe(handler, pairs, last_event_id):
+                self._send_error_response(handler, 503, "Too many stream subscribers")
+        except Exception as e:
+            self._send_error_response(handler, 500, "Database error")
+
+    def handle_get_exchange_rate_ohlc(self, handler, path_params, query_params):
+        """
+        Candles of a pair from the rollup table: /exchangeRate/{pair}/ohlc?interval=1h&from=&to=&limit=
+        """
+        try:
+            if "base" not in path_params:
+                self._send_error_response(handler, 400, "Invalid currency pair format")
+                return
+            base_code = path_params["base"].upper()
+            target_code = path_params["target"].upper()
+            
+            interval = query_params['interval'][0] if 'interval' in query_params else "1h"
+            if interval not in CANDLE_INTERVALS:
+                self._send_error_response(
+                    handler, 400, f"Parameter 'interval' must be one of: {', '.join(CANDLE_INTERVALS)}"
+                )
+                return
+            try:
+                from_at = parse_timestamp(query_params['from'][0]) if 'from' in query_params else 0.0
+                to_at = parse_timestamp(query_params['to'][0]) if 'to' in query_params else float("inf")
+            except ValueError:
+                self._send_error_response(handler, 400, "Invalid 'from' or 'to' timestamp")
+                return
+            try:
+                limit = int(query_params['limit'][0]) if 'limit' in query_params else 1000
+                if not 0 < limit <= MAX_HISTORY_ROWS:
+                    raise ValueError("limit out of range")
+            except ValueError:
+                self._send_error_response(handler, 400, f"Parameter 'limit' must be between 1 and {MAX_HISTORY_ROWS}")
+                return
+            
+            base_currency = self._currency_dao.get_currency_by_code(base_code)
+            target_currency = self._currency_dao.get_currency_by_code(target_code)
+            
+            if not base_currency or not target_currency:
+                self._send_error_response(handler, 404, "Currency not found")
                 return
             
-            formatted_rate = {
-                "id": exchange_rate["id"],
-                "baseCurrency": {
-                    "id": base_currency["id"],
-                    "name": base_currency["fullname"],
-                    "code": base_currency["code"],
-                    "sign": base_currency["sign"]
-                },
-                "targetCurrency": {
-                    "id": target_currency["id"],
-                    "name": target_currency["fullname"],
-                    "code": target_currency["code"],
-                    "sign": target_currency["sign"]
-                },
-                "rate": exchange_rate["rate"]
+            candles = self._exchange_rates_dao.get_candles(
+                base_currency.id, target_currency.id, interval, from_at, to_at, limit
+            )
+            
+            response = {
+                "baseCurrency": currency_to_dict(base_currency),
+                "targetCurrency": currency_to_dict(target_currency),
+                "interval": interval,
+                "candles": [
+                    {
+                        "timestamp": format_timestamp(candle["bucket_start"]),
+                        "open": candle["open"],
+                        "high": candle["high"],
+                        "low": candle["low"],
+                        "close": candle["close"],
+                        "average": candle["average"],
+                        "count": candle["count"]
+                    }
+                    for candle in candles
+                ]
             }
             
+            body = json.dumps(response, ensure_ascii=False).encode('utf-8')
             handler.send_response(200)
             handler.send_header("Content-Type", "application/json; charset=utf-8")
             handler.send_header("Access-Control-Allow-Origin", "*")
             handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
             handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-            handler.end_headers()
-            handler.wfile.write(json.dumps(formatted_rate, ensure_ascii=False).encode('utf-8'))
+            send_body(handler, body)
             
         except Exception as e:
             self._send_error_response(handler, 500, "Database error")
 
-    def handle_post_exchange_rates(self, handler):
+    def handle_post_exchange_rates(self, handler, path_params, query_params):
         try:
             content_length = int(handler.headers.get('Content-Length', 0))
             if content_length == 0:
@@ -158,33 +355,16 @@ class ExchangeRateController:
                 return
             
             rate_id = self._exchange_rates_dao.insert(
-                base_currency["id"], target_currency["id"], rate
+                base_currency.id, target_currency.id, rate
             )
             
-            new_rate = {
-                "id": rate_id,
-                "baseCurrency": {
-                    "id": base_currency["id"],
-                    "name": base_currency["fullname"],
-                    "code": base_currency["code"],
-                    "sign": base_currency["sign"]
-                },
-                "targetCurrency": {
-                    "id": target_currency["id"],
-                    "name": target_currency["fullname"],
-                    "code": target_currency["code"],
-                    "sign": target_currency["sign"]
-                },
-                "rate": rate
-            }
-            
+            body = exchange_rate_to_json(rate_id, base_currency, target_currency, rate).encode('utf-8')
             handler.send_response(201)
             handler.send_header("Content-Type", "application/json; charset=utf-8")
             handler.send_header("Access-Control-Allow-Origin", "*")
             handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
             handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-            handler.end_headers()
-            handler.wfile.write(json.dumps(new_rate, ensure_ascii=False).encode('utf-8'))
+            send_body(handler, body)
             
         except ValueError as e:
             if "already exists" in str(e) or "invalid" in str(e).lower():
@@ -194,21 +374,99 @@ class ExchangeRateController:
         except Exception as e:
             self._send_error_response(handler, 500, "Database error")
 
-    def handle_patch_exchange_rate(self, handler):
+    def handle_post_exchange_rates_bulk(self, handler, path_params, query_params):
+        """
+        Creates or updates many rates from a JSON array of {"base", "target", "rate"} rows
+        in a single transaction and reports the outcome of every row
+        """
         try:
-            path = handler.path
-            path_parts = path.split("/")
-            if len(path_parts) < 3 or not path_parts[-1]:
-                self._send_error_response(handler, 400, "Currency pair codes are missing")
+            content_length = int(handler.headers.get('Content-Length', 0))
+            if content_length == 0:
+                self._send_error_response(handler, 400, "Request body is required")
                 return
-            
-            currency_pair = path_parts[-1].upper()
-            if len(currency_pair) != 6:
-                self._send_error_response(handler, 400, "Invalid currency pair format")
+
+            try:
+                rows = json.loads(handler.rfile.read(content_length).decode('utf-8'))
+            except (ValueError, UnicodeDecodeError):
+                self._send_error_response(handler, 400, "Request body must be valid JSON")
+                return
+            if not isinstance(rows, list):
+                self._send_error_response(handler, 400, "Request body must be a JSON array")
+                return
+            if len(rows) > MAX_BULK_ROWS:
+                self._send_error_response(handler, 400, f"Bulk upload is limited to {MAX_BULK_ROWS} rows")
+                return
+
+            results = []
+            valid_rows = []
+            valid_results = []
+            for row in rows:
+                if not isinstance(row, dict):
+                    results.append({"status": "error", "message": "Row must be an object"})
+                    continue
+                base_code = str(row.get('base', '')).strip().upper()
+                target_code = str(row.get('target', '')).strip().upper()
+                result = {"baseCurrencyCode": base_code, "targetCurrencyCode": target_code}
+                results.append(result)
+
+                missing = [field for field in ('base', 'target', 'rate') if not str(row.get(field, '')).strip()]
+                if missing:
+                    result.update(status="error", message=f"Required field '{missing[0]}' is missing")
+                    continue
+                try:
+                    rate = float(row['rate'])
+                    if not math.isfinite(rate) or rate <= 0:
+                        raise ValueError("Rate must be positive")
+                except (ValueError, TypeError):
+                    result.update(status="error", message="Invalid rate value")
+                    continue
+
+                base_currency = self._currency_dao.get_currency_by_code(base_code)
+                target_currency = self._currency_dao.get_currency_by_code(target_code)
+                if not base_currency:
+                    result.update(status="error", message=f"Base currency '{base_code}' not found")
+                    continue
+                if not target_currency:
+                    result.update(status="error", message=f"Target currency '{target_code}' not found")
+                    continue
+
+                result["rate"] = rate
+                valid_rows.append((base_currency.id, target_currency.id, rate))
+                valid_results.append(result)
+
+            statuses = self._exchange_rates_dao.upsert_many(valid_rows)
+            for result, status in zip(valid_results, statuses):
+                result["status"] = status
+
+            summary = {
+                "created": statuses.count("created"),
+                "updated": statuses.count("updated"),
+                "failed": len(results) - len(statuses),
+                "rows": results
+            }
+
+            body = json.dumps(summary, ensure_ascii=False).encode('utf-8')
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json; charset=utf-8")
+            handler.send_header("Access-Control-Allow-Origin", "*")
+            handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
+            handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+            send_body(handler, body)
+
+        except Exception as e:
+            self._send_error_response(handler, 500, "Database error")
+
+    def handle_patch_exchange_rate(self, handler, path_params, query_params):
+        try:
+            if "base" not in path_params:
+                if path_params.get("pair"):
+                    self._send_error_response(handler, 400, "Invalid currency pair format")
+                else:
+                    self._send_error_response(handler, 400, "Currency pair codes are missing")
                 return
                 
-            base_code = currency_pair[:3]
-            target_code = currency_pair[3:]
+            base_code = path_params["base"].upper()
+            target_code = path_params["target"].upper()
             
             content_length = int(handler.headers.get('Content-Length', 0))
             if content_length == 0:
@@ -240,7 +498,7 @@ class ExchangeRateController:
                 return
             
             success = self._exchange_rates_dao.set_exchange_rate(
-                base_currency["id"], target_currency["id"], rate
+                base_currency.id, target_currency.id, rate
             )
             
             if not success:
@@ -248,43 +506,26 @@ class ExchangeRateController:
                 return
             
             updated_rate = self._exchange_rates_dao.get_exchange_rate(
-                base_currency["id"], target_currency["id"]
+                base_currency.id, target_currency.id
             )
             
-            formatted_rate = {
-                "id": updated_rate["id"],
-                "baseCurrency": {
-                    "id": base_currency["id"],
-                    "name": base_currency["fullname"],
-                    "code": base_currency["code"],
-                    "sign": base_currency["sign"]
-                },
-                "targetCurrency": {
-                    "id": target_currency["id"],
-                    "name": target_currency["fullname"],
-                    "code": target_currency["code"],
-                    "sign": target_currency["sign"]
-                },
-                "rate": rate
-            }
-            
+            body = exchange_rate_to_json(updated_rate.id, base_currency, target_currency, rate).encode('utf-8')
             handler.send_response(200)
             handler.send_header("Content-Type", "application/json; charset=utf-8")
             handler.send_header("Access-Control-Allow-Origin", "*")
             handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
             handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-            handler.end_headers()
-            handler.wfile.write(json.dumps(formatted_rate, ensure_ascii=False).encode('utf-8'))
+            send_body(handler, body)
             
         except Exception as e:
             self._send_error_response(handler, 500, "Database error")
 
     def _send_error_response(self, handler, status_code, message):
         error_response = {"message": message}
+        body = json.dumps(error_response, ensure_ascii=False).encode('utf-8')
         handler.send_response(status_code)
         handler.send_header("Content-Type", "application/json; charset=utf-8")
         handler.send_header("Access-Control-Allow-Origin", "*")
         handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS") 
         handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        handler.end_headers()
-        handler.wfile.write(json.dumps(error_response, ensure_ascii=False).encode('utf-8'))
\ No newline at end of file
+        send_body(handler, body)
\ No newline at end of file
@@ -0,0 +1,61 @@
+import json
+from json.encoder import encode_basestring
+
+# Writers of the API JSON for DAO records, byte for byte what
+# json.dumps(..., ensure_ascii=False) gives for the equivalent dicts,
+# without building those dicts first.
+
+
+def _number(value):
+    if value.__class__ is int:
+        return int.__repr__(value)
+    if value.__class__ is float and value - value == 0.0:
+        return float.__repr__(value)
+    # NaN, infinities, Decimal subclasses and anything else unusual
+    return json.dumps(value)
+
+
+def currency_to_json(currency):
+    return (
+        f'{{"id": {currency.id}, "name": {encode_basestring(currency.fullname)}, '
+        f'"code": {encode_basestring(currency.code)}, "sign": {encode_basestring(currency.sign)}}}'
+    )
+
+
+def currency_to_dict(currency):
+    """For documents that embed a currency and are serialized with json.dumps()"""
+    return {"id": currency.id, "name": currency.fullname, "code": currency.code, "sign": currency.sign}
+
+
+def exchange_rate_to_json(rate_id, base_currency, target_currency, rate):
+    return (
+        f'{{"id": {rate_id}, "baseCurrency": {currency_to_json(base_currency)}, '
+        f'"targetCurrency": {currency_to_json(target_currency)}, "rate": {_number(rate)}}}'
+    )
+
+
+def currencies_to_json(currencies):
+    """Serializes a list of Currency records into UTF-8 JSON bytes"""
+    return ("[" + ", ".join([currency_to_json(currency) for currency in currencies]) + "]").encode("utf-8")
+
+
+def exchange_rates_to_json(rates):
+    """
+    Serializes a list of ExchangeRateWithCurrencies into UTF-8 JSON bytes.
+    Each currency is serialized once, however many rates it appears in.
+    """
+    currency_json = {}
+    parts = []
+    for rate in rates:
+        base, target = rate.base_currency, rate.target_currency
+        base_json = currency_json.get(base.id)
+        if base_json is None:
+            base_json = currency_json[base.id] = currency_to_json(base)
+        target_json = currency_json.get(target.id)
+        if target_json is None:
+            target_json = currency_json[target.id] = currency_to_json(target)
+        parts.append(
+            f'{{"id": {rate.id}, "baseCurrency": {base_json}, '
+            f'"targetCurrency": {target_json}, "rate": {_number(rate.rate)}}}'
+        )
+    return ("[" + ", ".join(parts) + "]").encode("utf-8")
@@ -30,6 +30,144 @@ class DatabaseCreator:
             FOREIGN KEY(targetCurrencyId) REFERENCES Currencies(id)
         );
         """)
+        # Keyset pages filtered by one side of the pair walk these in id order
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_exchange_rates_base
+        ON ExchangeRates (baseCurrencyId, id);
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_exchange_rates_target
+        ON ExchangeRates (targetCurrencyId, id);
+        """)
+
+    def create_table_exchange_rate_history(self, cursor):
+        """
+        Every rate change is copied into ExchangeRateHistory by triggers, stamped
+        with the unix time of the write. The (pair, time) index keeps as-of lookups
+        logarithmic however long the history grows.
+        """
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ExchangeRateHistory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            baseCurrencyId INTEGER NOT NULL,
+            targetCurrencyId INTEGER NOT NULL,
+            rate DECIMAL(20,6) NOT NULL,
+            changedAt REAL NOT NULL,
+            FOREIGN KEY(baseCurrencyId) REFERENCES Currencies(id),
+            FOREIGN KEY(targetCurrencyId) REFERENCES Currencies(id)
+        );
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_history_pair_time
+        ON ExchangeRateHistory (baseCurrencyId, targetCurrencyId, changedAt);
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_exchange_rates_history_insert
+        AFTER INSERT ON ExchangeRates
+        BEGIN
+            INSERT INTO ExchangeRateHistory (baseCurrencyId, targetCurrencyId, rate, changedAt)
+            VALUES (NEW.baseCurrencyId, NEW.targetCurrencyId, NEW.rate,
+                    (julianday('now') - 2440587.5) * 86400.0);
+        END;
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_exchange_rates_history_update
+        AFTER UPDATE OF rate ON ExchangeRates
+        WHEN NEW.rate IS NOT OLD.rate
+        BEGIN
+            INSERT INTO ExchangeRateHistory (baseCurrencyId, targetCurrencyId, rate, changedAt)
+            VALUES (NEW.baseCurrencyId, NEW.targetCurrencyId, NEW.rate,
+                    (julianday('now') - 2440587.5) * 86400.0);
+        END;
+        """)
+
+    def create_table_data_versions(self, cursor):
+        """
+        Per-table version counters behind the HTTP validators. Triggers bump
+        them with every write, so all processes see the same versions. They
+        start at the creation time in milliseconds, so a recreated database
+        does not repeat the versions of the old one.
+        """
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS DataVersions (
+            tableName TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            changedAt REAL NOT NULL
+        );
+        """)
+        for table in ("Currencies", "ExchangeRates"):
+            cursor.execute("""
+            INSERT OR IGNORE INTO DataVersions (tableName, version, changedAt)
+            VALUES (?, CAST((julianday('now') - 2440587.5) * 86400000.0 AS INTEGER),
+                    (julianday('now') - 2440587.5) * 86400.0);
+            """, (table,))
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE DataVersions
+                    SET version = version + 1, changedAt = (julianday('now') - 2440587.5) * 86400.0
+                    WHERE tableName = '{table}';
+                END;
+                """)
+
+    def create_table_exchange_rate_candles(self, cursor):
+        """
+        Open/high/low/close rollups of the rate history in 1m, 1h and 1d buckets.
+        A trigger on ExchangeRateHistory updates the three buckets of every new
+        change, so reads never aggregate raw history.
+        """
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ExchangeRateCandles (
+            baseCurrencyId INTEGER NOT NULL,
+            targetCurrencyId INTEGER NOT NULL,
+            interval TEXT NOT NULL,
+            bucketStart INTEGER NOT NULL,
+            open DECIMAL(20,6) NOT NULL,
+            high DECIMAL(20,6) NOT NULL,
+            low DECIMAL(20,6) NOT NULL,
+            close DECIMAL(20,6) NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (baseCurrencyId, targetCurrencyId, interval, bucketStart)
+        ) WITHOUT ROWID;
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_exchange_rate_history_candles
+        AFTER INSERT ON ExchangeRateHistory
+        BEGIN
+            INSERT INTO ExchangeRateCandles
+                (baseCurrencyId, targetCurrencyId, interval, bucketStart, open, high, low, close, total, count)
+            SELECT NEW.baseCurrencyId, NEW.targetCurrencyId, buckets.name,
+                   CAST(NEW.changedAt / buckets.seconds AS INTEGER) * buckets.seconds,
+                   NEW.rate, NEW.rate, NEW.rate, NEW.rate, NEW.rate, 1
+            FROM (SELECT '1m' AS name, 60 AS seconds
+                  UNION ALL SELECT '1h', 3600
+                  UNION ALL SELECT '1d', 86400) AS buckets
+            WHERE true
+            ON CONFLICT (baseCurrencyId, targetCurrencyId, interval, bucketStart) DO UPDATE SET
+                high = max(high, excluded.high),
+                low = min(low, excluded.low),
+                close = excluded.close,
+                total = total + excluded.total,
+                count = count + 1;
+        END;
+        """)
+
+    def backfill_exchange_rate_history(self, cursor):
+        """
+        Databases created before the history existed start it from their current rates
+        """
+        cursor.execute("""
+        INSERT INTO ExchangeRateHistory (baseCurrencyId, targetCurrencyId, rate, changedAt)
+        SELECT r.baseCurrencyId, r.targetCurrencyId, r.rate, (julianday('now') - 2440587.5) * 86400.0
+        FROM ExchangeRates r
+        WHERE NOT EXISTS (
+            SELECT 1 FROM ExchangeRateHistory h
+            WHERE h.baseCurrencyId = r.baseCurrencyId AND h.targetCurrencyId = r.targetCurrencyId
+        );
+        """)
 
     def insert_currencies(self, cursor):
         currencies = [
@@ -89,6 +227,23 @@ class DatabaseCreator:
         result = cursor.fetchone()
         return result[0] if result else None
 
+    def create_schema(self):
+        """
+        Creates missing tables, indexes and triggers without adding any data.
+        Safe to run on every start.
+        """
+        with sqlite3.connect(self._db_path) as db:
+            cursor = db.cursor()
+            cursor.execute("PRAGMA foreign_keys = ON;")
+            self.create_table_currencies(cursor)
+            self.create_table_exchange_rates(cursor)
+            self.create_table_exchange_rate_history(cursor)
+            self.create_table_exchange_rate_candles(cursor)
+            self.create_table_data_versions(cursor)
+            self.backfill_exchange_rate_history(cursor)
+            db.commit()
+        db.close()
+
     def init_all(self):
         """
         Full initialization: creates tables and fills with initial data
@@ -98,6 +253,9 @@ class DatabaseCreator:
             cursor.execute("PRAGMA foreign_keys = ON;")
             self.create_table_currencies(cursor)
             self.create_table_exchange_rates(cursor)
+            self.create_table_exchange_rate_history(cursor)
+            self.create_table_exchange_rate_candles(cursor)
+            self.create_table_data_versions(cursor)
             self.insert_currencies(cursor)
             self.insert_exchange_rates(cursor)
             db.commit()
@@ -0,0 +1,157 @@
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+from models.db import DB
+from models.exchange_rates_dao import ExchangeRatesDAO
+
+class RateImporter:
+    """
+    Streams exchange rates from an NDJSON or CSV file into the database.
+
+    Rows look like {"base": "USD", "target": "EUR", "rate": 0.92} (NDJSON) or
+    base,target,rate (CSV with a header). The file is read row by row and
+    written in transactions of batch_size rows, so memory use does not depend
+    on the file size.
+    """
+
+    required_tables = ("Currencies", "ExchangeRates", "ExchangeRateHistory")
+
+    def __init__(self, db: DB, batch_size=5000, report_every=2.0, out=None):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self._db = db
+        self._exchange_rates_dao = ExchangeRatesDAO(db)
+        self._batch_size = batch_size
+        self._report_every = report_every
+        self._out = out if out is not None else sys.stderr
+        self.read = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+
+    def missing_tables(self):
+        """
+        Returns the tables the import writes to that the database does not have
+        """
+        with self._db.connection() as conn:
+            cursor = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
+            existing = {row[0] for row in cursor.fetchall()}
+        return [table for table in self.required_tables if table not in existing]
+
+    def _load_currency_ids(self):
+        with self._db.connection() as conn:
+            cursor = conn.execute("SELECT code, id FROM Currencies;")
+            return dict(cursor.fetchall())
+
+    def read_rows(self, stream, file_format):
+        """
+        Yields (line_number, row dict) from the stream
+        """
+        if file_format == "csv":
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(stream, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_number, row
+
+    def _parse(self, row, currency_ids):
+        if not isinstance(row, dict):
+            raise ValueError("not a JSON object")
+        base_code = str(row.get("base") or "").strip().upper()
+        target_code = str(row.get("target") or "").strip().upper()
+        if base_code not in currency_ids:
+            raise ValueError(f"unknown base currency '{base_code}'")
+        if target_code not in currency_ids:
+            raise ValueError(f"unknown target currency '{target_code}'")
+        try:
+            rate = float(row.get("rate"))
+        except (TypeError, ValueError):
+            raise ValueError("invalid rate value") from None
+        if not math.isfinite(rate) or rate <= 0:
+            raise ValueError("invalid rate value")
+        return currency_ids[base_code], currency_ids[target_code], rate
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        statuses = self._exchange_rates_dao.upsert_many(batch)
+        created = statuses.count("created")
+        self.created += created
+        self.updated += len(statuses) - created
+        batch.clear()
+
+    def run(self, stream, file_format):
+        currency_ids = self._load_currency_ids()
+        started = last_report = time.monotonic()
+        batch = []
+        for line_number, row in self.read_rows(stream, file_format):
+            self.read += 1
+            try:
+                batch.append(self._parse(row, currency_ids))
+            except ValueError as e:
+                self.skipped += 1
+                if self.skipped <= 20:
+                    print(f"Line {line_number} skipped: {e}", file=self._out)
+            if len(batch) >= self._batch_size:
+                self._flush(batch)
+                now = time.monotonic()
+                if now - last_report >= self._report_every:
+                    self._report(now - started)
+                    last_report = now
+        self._flush(batch)
+        self._report(time.monotonic() - started, final=True)
+
+    def _report(self, elapsed, final=False):
+        per_second = self.read / elapsed if elapsed > 0 else 0.0
+        prefix = "Done:" if final else "Progress:"
+        print(
+            f"{prefix} {self.read} rows read, {self.created} created, {self.updated} updated, "
+            f"{self.skipped} skipped in {elapsed:.1f}s ({per_second:,.0f} rows/s)",
+            file=self._out
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import exchange rates from an NDJSON or CSV file")
+    parser.add_argument("path", help="file to import, '-' for stdin")
+    parser.add_argument("--format", choices=("ndjson", "csv"),
+                        help="file format (default: guessed from the extension, ndjson otherwise)")
+    parser.add_argument("--db", default="currency_exchange.db", help="database file")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per transaction")
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    # Opening a missing file would create an empty database
+    if not os.path.isfile(args.db):
+        parser.error(f"database '{args.db}' not found, create it with database_setup.py first")
+
+    file_format = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    db = DB(args.db)
+    importer = RateImporter(db, batch_size=args.batch_size)
+    try:
+        missing = importer.missing_tables()
+        if missing:
+            parser.error(f"database '{args.db}' has no {', '.join(missing)} table(s), "
+                         f"create them with database_setup.py first")
+        if args.path == "-":
+            importer.run(sys.stdin, file_format)
+        else:
+            with open(args.path, "r", encoding="utf-8", newline="") as stream:
+                importer.run(stream, file_format)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,99 @@
 from models.db import DB
+from models.records import Currency
+import bisect
 import sqlite3
+import threading
 
 class CurrencyDAO:
     """
-    DAO class for Currency table
+    DAO class for Currency table.
+
+    The table is small and rarely written, so it is kept in an in-memory
+    registry indexed by code and by id. The registry is reloaded after every
+    write made through this DB and whenever another process changes the file.
+    Lookups return the shared, immutable Currency records of the registry.
     """
     def __init__(self, db: DB):
         self._db = db
+        self._lock = threading.Lock()
+        self._by_code = {}
+        self._by_id = {}
+        self._ids = []
+        self.reload()
+        db.add_write_listener(self._on_write)
+
+    def _on_write(self, table, key):
+        if table is None or table == "Currencies":
+            self.reload()
+
+    def reload(self):
+        """
+        Re-reads the Currencies table into the registry
+        """
+        with self._lock:
+            with self._db.connection() as conn:
+                cursor = conn.execute("SELECT id, code, fullname, sign FROM Currencies ORDER BY id;")
+                rows = cursor.fetchall()
+            by_code = {}
+            by_id = {}
+            for currency in map(Currency._make, rows):
+                by_code[currency.code] = currency
+                by_id[currency.id] = currency
+            self._by_code, self._by_id, self._ids = by_code, by_id, sorted(by_id)
+
+    def version(self):
+        """
+        Returns (token, last_modified) of the Currencies table, see DB.version()
+        """
+        return self._db.version("Currencies")
 
     def get_all_currencies(self):
-        conn, cursor = self._db.get_cursor()
-        try: 
-            cursor.execute("SELECT id, code, fullname, sign FROM Currencies;")
-            rows = cursor.fetchall()
-            return [
-                {
-                    "id": row[0],
-                    "code": row[1],
-                    "fullname": row[2],
-                    "sign": row[3]
-                }
-                for row in rows
-            ]
-        finally:
-            conn.close()
+        self._db.check_external_changes()
+        return list(self._by_id.values())
+
+    def get_currencies_page(self, after_id=0, limit=None, codes=None):
+        """
+        Returns up to limit currencies with id > after_id in id order,
+        optionally only those whose code is in codes
+        """
+        self._db.check_external_changes()
+        if codes is not None:
+            by_code = self._by_code
+            ids = sorted(by_code[code].id for code in codes if code in by_code)
+        else:
+            ids = self._ids
+        start = bisect.bisect_right(ids, after_id)
+        end = len(ids) if limit is None else start + limit
+        by_id = self._by_id
+        return [by_id[currency_id] for currency_id in ids[start:end]]
 
     def get_currency_by_code(self, code: str):
-        conn, cursor = self._db.get_cursor()
-        try:
-            cursor.execute(
-                "SELECT id, code, fullname, sign FROM Currencies WHERE code = ?;",
-                (code.upper(),)
-            )
-            row = cursor.fetchone()
-            if row:
-                return {
-                    "id": row[0],
-                    "code": row[1],
-                    "fullname": row[2],
-                    "sign": row[3]
-                }
-            return None
-        finally:
-            conn.close()
+        self._db.check_external_changes()
+        return self._by_code.get(code.upper())
 
     def get_currency_by_id(self, currency_id: int):
-        conn, cursor = self._db.get_cursor()
-        try:
-            cursor.execute(
-                "SELECT id, code, fullname, sign FROM Currencies WHERE id = ?;",
-                (currency_id,)
-            )
-            row = cursor.fetchone()
-            if row:
-                return {
-                    "id": row[0],
-                    "code": row[1],
-                    "fullname": row[2],
-                    "sign": row[3]
-                }
-            return None
-        finally:
-            conn.close()
+        self._db.check_external_changes()
+        return self._by_id.get(currency_id)
 
     def insert(self, code: str, fullname: str, sign: str):
-        conn, cursor = self._db.get_cursor()
         try:
-            cursor.execute(
-                "INSERT INTO Currencies (code, fullname, sign) VALUES (?, ?, ?);",
-                (code.upper(), fullname, sign)
-            )
-            conn.commit()
-            return cursor.lastrowid
+            with self._db.transaction() as conn:
+                cursor = conn.execute(
+                    "INSERT INTO Currencies (code, fullname, sign) VALUES (?, ?, ?);",
+                    (code.upper(), fullname, sign)
+                )
         except sqlite3.IntegrityError as e:
             raise ValueError(f"Currency with code '{code}' already exists.") from e
-        finally:
-            conn.close()
+        self._db.notify_write("Currencies", code.upper())
+        return cursor.lastrowid
 
     def update_by_code(self, code: str, fullname: str, sign: str):
-        conn, cursor = self._db.get_cursor()
-        try:
-            cursor.execute(
+        with self._db.transaction() as conn:
+            cursor = conn.execute(
                 "UPDATE Currencies SET fullname = ?, sign = ? WHERE code = ?;",
                 (fullname, sign, code.upper())
             )
-            conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            conn.close()
\ No newline at end of file
+        if cursor.rowcount > 0:
+            self._db.notify_write("Currencies", code.upper())
+            return True
+        return False
@@ -1,24 +1,295 @@
+import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _WriteThroughConnection:
+    """
+    Stands in for the writer connection inside transaction() when the
+    in-memory replica is on: statements run on the file as usual, and all
+    but SELECTs are also recorded to be replayed on the replica once the
+    file has committed.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.statements = []
+
+    def execute(self, sql, parameters=()):
+        cursor = self._conn.execute(sql, parameters)
+        if not sql.lstrip().upper().startswith("SELECT"):
+            self.statements.append((False, sql, parameters))
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        cursor = self._conn.executemany(sql, seq_of_parameters)
+        self.statements.append((True, sql, seq_of_parameters))
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
 
 class DB:
     """
     Class for connecting to the currency_exchange database
     """
-    def __init__(self, db_path="currency_exchange.db"):
+    def __init__(self, db_path="currency_exchange.db", pool_size=8,
+                 busy_timeout_ms=5000, cache_size_kib=8192, synchronous="NORMAL",
+                 in_memory_replica=False, replica_sync_interval=None):
+        """
+        With in_memory_replica the file is copied into a shared in-memory database
+        at startup, and again after a commit by another process or every
+        replica_sync_interval seconds if that is set.
+        """
         self._db_path = db_path
+        self._busy_timeout_ms = busy_timeout_ms
+        self._cache_size_kib = cache_size_kib
+        self._synchronous = synchronous
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._data_version = None
+        self._listeners = []
+        self._version_lock = threading.Lock()
+        # table -> (version, time of the last write) as last read from DataVersions
+        self._versions = {}
+        self._version_generation = 0
+        # Keeps the replicas of several instances in one process apart
+        self._instance = os.urandom(4).hex()
+        self._replica = None
+        self._replica_sync_interval = replica_sync_interval
+        self._replica_synced_at = None
+        # A foreign commit the replica has caught up with but listeners have not heard of
+        self._unreported_change = False
+        if in_memory_replica:
+            self._replica_uri = f"file:/currency_exchange_replica_{os.getpid()}_{self._instance}?vfs=memdb"
+            with self._write_lock:
+                # The replica lives as long as one connection to it is open, this one
+                self._replica = self._connect_replica()
+                self._load_replica()
 
     def connect_to_db(self):
         """
-        Returns a new connection to the db
+        Returns a new configured connection to the db
         """
-        connection = sqlite3.connect(self._db_path)
+        connection = sqlite3.connect(
+            self._db_path,
+            timeout=self._busy_timeout_ms / 1000,
+            check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode = WAL;")
+        connection.execute(f"PRAGMA synchronous = {self._synchronous};")
+        connection.execute(f"PRAGMA busy_timeout = {int(self._busy_timeout_ms)};")
+        # A negative cache_size is measured in KiB rather than pages
+        connection.execute(f"PRAGMA cache_size = -{int(self._cache_size_kib)};")
         connection.execute("PRAGMA foreign_keys = ON;")
         return connection
-    
-    def get_cursor(self):
+
+    def _connect_replica(self):
+        connection = sqlite3.connect(
+            self._replica_uri,
+            uri=True,
+            timeout=self._busy_timeout_ms / 1000,
+            check_same_thread=False
+        )
+        connection.execute("PRAGMA foreign_keys = ON;")
+        return connection
+
+    def _load_replica(self):
+        """Copies the file into the replica; the caller holds the write lock"""
+        replica = self._replica
+        # The copy carries the file's WAL flag, which memdb cannot open for
+        # shared use; holding the lock exclusively lets it be switched off
+        replica.execute("PRAGMA locking_mode = EXCLUSIVE;")
+        self._writer_connection().backup(replica)
+        replica.execute("PRAGMA journal_mode = MEMORY;")
+        replica.execute("PRAGMA locking_mode = NORMAL;")
+        # The exclusive lock is only given up on the next access
+        replica.execute("SELECT 1 FROM sqlite_master LIMIT 1;").fetchall()
+        self._replica_synced_at = time.monotonic()
+
+    def _poll_file(self):
+        """
+        Returns True if another process has committed to the file since the last
+        poll, and copies the replica again if so or if the sync interval has
+        passed. The caller holds the write lock.
+        """
+        previous = self._data_version
+        self._data_version = self._writer_connection().execute("PRAGMA data_version;").fetchone()[0]
+        changed = previous is not None and self._data_version != previous
+        if self._replica is not None and (changed or (
+                self._replica_sync_interval is not None
+                and time.monotonic() - self._replica_synced_at >= self._replica_sync_interval)):
+            self._load_replica()
+        return changed
+
+    def _refresh_replica(self):
+        """
+        Brings the replica up to date before a read. Listeners may be the ones
+        reading, so a foreign commit found here is only reported by the next
+        check_external_changes().
+        """
+        if not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            if self._poll_file():
+                self._unreported_change = True
+        finally:
+            self._write_lock.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a pooled connection for reading and returns it to the pool afterwards.
+        The connection reads from the in-memory replica when there is one.
+        """
+        if self._replica is not None:
+            self._refresh_replica()
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self.connect_to_db() if self._replica is None else self._connect_replica()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yields the writer connection; commits on success and rolls back on error.
+        All writes of this process go through it. With a replica, the statements
+        are replayed on it once the file has committed.
+        """
+        with self._write_lock:
+            conn = self._writer_connection()
+            if self._replica is not None:
+                conn = _WriteThroughConnection(conn)
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            if self._replica is not None:
+                self._replay_on_replica(conn.statements)
+
+    def _replay_on_replica(self, statements):
+        """
+        Applies a committed transaction to the replica. Should the replica
+        refuse it, it is copied from the file again instead. Triggers that
+        stamp julianday('now') run again here, so replica history timestamps
+        can trail the file's by the replay delay until the next copy.
+        """
+        try:
+            for many, sql, parameters in statements:
+                if many:
+                    self._replica.executemany(sql, parameters)
+                else:
+                    self._replica.execute(sql, parameters)
+            self._replica.commit()
+        except sqlite3.Error:
+            self._replica.rollback()
+            self._load_replica()
+
+    def _writer_connection(self):
+        if self._writer is None:
+            self._writer = self.connect_to_db()
+            self._data_version = self._writer.execute("PRAGMA data_version;").fetchone()[0]
+        return self._writer
+
+    def add_write_listener(self, callback):
+        """
+        Registers callback(table, key), called after every committed write.
+        table is None when the change came from another process and may touch anything.
+        """
+        self._listeners.append(callback)
+
+    def notify_write(self, table, key=None):
+        """
+        Tells the listeners that a write to table has been committed
+        """
+        with self._version_lock:
+            self._version_generation += 1
+            if table is None:
+                self._versions.clear()
+            else:
+                self._versions.pop(table, None)
+        for callback in list(self._listeners):
+            callback(table, key)
+
+    def version(self, *tables):
+        """
+        Returns (token, last_modified) for data read from the given tables.
+        The token comes from the DataVersions counters that triggers bump with
+        every write, so every process returns the same token for the same data;
+        last_modified is the time of the latest such write.
+        """
+        self.check_external_changes()
+        with self._version_lock:
+            generation = self._version_generation
+            parts = {table: self._versions.get(table) for table in tables}
+        missing = [table for table, part in parts.items() if part is None]
+        if missing:
+            with self.connection() as conn:
+                cursor = conn.execute(
+                    f"""
+                    SELECT tableName, version, changedAt FROM DataVersions
+                    WHERE tableName IN ({", ".join("?" * len(missing))});
+                    """,
+                    missing
+                )
+                found = {name: (version, changed_at) for name, version, changed_at in cursor.fetchall()}
+            for table in missing:
+                parts[table] = found.get(table, (0, 0.0))
+            with self._version_lock:
+                # A write since the read above would leave a stale version behind
+                if self._version_generation == generation:
+                    self._versions.update((table, parts[table]) for table in missing)
+        token = "-".join(str(parts[table][0]) for table in tables)
+        return token, max(modified for _, modified in parts.values())
+
+    def check_external_changes(self):
+        """
+        Returns True (and notifies the listeners) if another process has committed
+        since the last check. The writer connection performs every write of this
+        process, so its PRAGMA data_version only moves for foreign commits.
+        If a write is in progress the check is skipped; the next call catches up.
+        """
+        if not self._write_lock.acquire(blocking=False):
+            return False
+        try:
+            changed = self._poll_file() or self._unreported_change
+            self._unreported_change = False
+        finally:
+            self._write_lock.release()
+        if changed:
+            self.notify_write(None)
+        return changed
+
+    def close(self):
         """
-        Returns a tuple (conn, cursor) for working with the DB
+        Closes all pooled connections
         """
-        conn = self.connect_to_db()
-        cursor = conn.cursor()
-        return conn, cursor
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if self._replica is not None:
+                self._replica.close()
+                self._replica = None
@@ -1,6 +1,11 @@
 from models.db import DB
+from models.records import Currency, ExchangeRate, ExchangeRateWithCurrencies
+import math
 import sqlite3
 
+# Candle intervals maintained by the ExchangeRateCandles trigger, in seconds
+CANDLE_INTERVALS = {"1m": 60, "1h": 3600, "1d": 86400}
+
 class ExchangeRatesDAO:
     """
     DAO class for ExchangeRates table
@@ -8,31 +13,72 @@ class ExchangeRatesDAO:
     def __init__(self, db: DB):
         self._db = db
 
+    def version(self):
+        """
+        Returns (token, last_modified) of the rates and the currencies embedded in them, see DB.version()
+        """
+        return self._db.version("Currencies", "ExchangeRates")
+
     def get_all(self):
-        conn, cursor = self._db.get_cursor()
-        try:
-            cursor.execute("""
+        with self._db.connection() as conn:
+            cursor = conn.execute("""
                 SELECT id, baseCurrencyId, targetCurrencyId, rate
                 FROM ExchangeRates;
             """)
             rows = cursor.fetchall()
-            
-            return [
-                {
-                    "id": row[0],
-                    "base_currency_id": row[1],
-                    "target_currency_id": row[2],
-                    "rate": row[3]
-                }
-                for row in rows
-            ]
-        finally:
-            conn.close()
+
+        return list(map(ExchangeRate._make, rows))
+
+    def get_all_with_currencies(self):
+        """
+        Returns all rates with their base and target currencies in one joined query
+        """
+        return self.get_page_with_currencies()
+
+    def get_page_with_currencies(self, after_id=0, limit=None, base_ids=None, target_ids=None):
+        """
+        Returns up to limit rates with id > after_id in id order, joined with their
+        currencies, optionally only those whose base / target id is in base_ids / target_ids.
+        Seeks by primary key (or the base / target indexes), so the cost follows the page size.
+        """
+        conditions = ["r.id > ?"]
+        params = [after_id]
+        if base_ids is not None:
+            conditions.append(f"r.baseCurrencyId IN ({', '.join('?' * len(base_ids))})")
+            params.extend(base_ids)
+        if target_ids is not None:
+            conditions.append(f"r.targetCurrencyId IN ({', '.join('?' * len(target_ids))})")
+            params.extend(target_ids)
+        params.append(-1 if limit is None else limit)
+        with self._db.connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT r.id, r.rate,
+                       b.id, b.code, b.fullname, b.sign,
+                       t.id, t.code, t.fullname, t.sign
+                FROM ExchangeRates r
+                JOIN Currencies b ON b.id = r.baseCurrencyId
+                JOIN Currencies t ON t.id = r.targetCurrencyId
+                WHERE {' AND '.join(conditions)}
+                ORDER BY r.id
+                LIMIT ?;
+            """, params)
+            rows = cursor.fetchall()
+
+        currencies = {}
+        rates = []
+        for row in rows:
+            base = currencies.get(row[2])
+            if base is None:
+                base = currencies[row[2]] = Currency._make(row[2:6])
+            target = currencies.get(row[6])
+            if target is None:
+                target = currencies[row[6]] = Currency._make(row[6:10])
+            rates.append(ExchangeRateWithCurrencies(row[0], row[1], base, target))
+        return rates
 
     def get_exchange_rate(self, base_id: int, target_id: int):
-        conn, cursor = self._db.get_cursor()
-        try:
-            cursor.execute(
+        with self._db.connection() as conn:
+            cursor = conn.execute(
                 """
                 SELECT id, baseCurrencyId, targetCurrencyId, rate
                 FROM ExchangeRates
@@ -41,42 +87,197 @@ class ExchangeRatesDAO:
                 (base_id, target_id)
             )
             row = cursor.fetchone()
-            if row:
-                return {
-                    "id": row[0],
-                    "base_currency_id": row[1],
-                    "target_currency_id": row[2],
-                    "rate": row[3]
-                }
-            return None
-        finally:
-            conn.close()
+        if row:
+            return ExchangeRate._make(row)
+        return None
+
+    def get_exchange_rate_at(self, base_id: int, target_id: int, at: float):
+        """
+        Returns the rate of the pair as it was at unix time at, or None.
+        A single seek on the (pair, changedAt) history index.
+        """
+        with self._db.connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT rate, changedAt
+                FROM ExchangeRateHistory
+                WHERE baseCurrencyId = ? AND targetCurrencyId = ? AND changedAt <= ?
+                ORDER BY changedAt DESC
+                LIMIT 1;
+                """,
+                (base_id, target_id, at)
+            )
+            row = cursor.fetchone()
+        if row:
+            return {
+                "base_currency_id": base_id,
+                "target_currency_id": target_id,
+                "rate": row[0],
+                "changed_at": row[1]
+            }
+        return None
+
+    def get_all_at(self, at: float):
+        """
+        Returns every pair with its rate as it was at unix time at, like get_all();
+        pairs that did not exist yet are left out. One index seek per pair.
+        """
+        with self._db.connection() as conn:
+            cursor = conn.execute("""
+                SELECT r.id, r.baseCurrencyId, r.targetCurrencyId, (
+                    SELECT h.rate
+                    FROM ExchangeRateHistory h
+                    WHERE h.baseCurrencyId = r.baseCurrencyId
+                      AND h.targetCurrencyId = r.targetCurrencyId
+                      AND h.changedAt <= ?
+                    ORDER BY h.changedAt DESC
+                    LIMIT 1
+                ) AS rate
+                FROM ExchangeRates r;
+            """, (at,))
+            rows = cursor.fetchall()
+
+        return [ExchangeRate._make(row) for row in rows if row[3] is not None]
+
+    def get_history(self, base_id: int, target_id: int, from_at: float, to_at: float, limit: int):
+        """
+        Returns up to limit changes of the pair between from_at and to_at, oldest first
+        """
+        with self._db.connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT rate, changedAt
+                FROM ExchangeRateHistory
+                WHERE baseCurrencyId = ? AND targetCurrencyId = ? AND changedAt BETWEEN ? AND ?
+                ORDER BY changedAt
+                LIMIT ?;
+                """,
+                (base_id, target_id, from_at, to_at, limit)
+            )
+            rows = cursor.fetchall()
+        return [{"rate": row[0], "changed_at": row[1]} for row in rows]
+
+    def get_last_history_id(self):
+        with self._db.connection() as conn:
+            cursor = conn.execute("SELECT COALESCE(MAX(id), 0) FROM ExchangeRateHistory;")
+            return cursor.fetchone()[0]
+
+    def get_history_since(self, last_id: int, limit: int):
+        """
+        Returns up to limit rate changes of any pair recorded after history row last_id
+        """
+        with self._db.connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT id, baseCurrencyId, targetCurrencyId, rate, changedAt
+                FROM ExchangeRateHistory
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?;
+                """,
+                (last_id, limit)
+            )
+            rows = cursor.fetchall()
+        return [
+            {
+                "id": row[0],
+                "base_currency_id": row[1],
+                "target_currency_id": row[2],
+                "rate": row[3],
+                "changed_at": row[4]
+            }
+            for row in rows
+        ]
+
+    def get_candles(self, base_id: int, target_id: int, interval: str, from_at: float, to_at: float, limit: int):
+        """
+        Returns up to limit OHLC buckets of the pair that overlap [from_at, to_at], oldest first
+        """
+        seconds = CANDLE_INTERVALS[interval]
+        first_bucket = math.floor(from_at / seconds) * seconds
+        with self._db.connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT bucketStart, open, high, low, close, total, count
+                FROM ExchangeRateCandles
+                WHERE baseCurrencyId = ? AND targetCurrencyId = ? AND interval = ?
+                  AND bucketStart BETWEEN ? AND ?
+                ORDER BY bucketStart
+                LIMIT ?;
+                """,
+                (base_id, target_id, interval, first_bucket, to_at, limit)
+            )
+            rows = cursor.fetchall()
+        return [
+            {
+                "bucket_start": row[0],
+                "open": row[1],
+                "high": row[2],
+                "low": row[3],
+                "close": row[4],
+                "average": row[5] / row[6],
+                "count": row[6]
+            }
+            for row in rows
+        ]
 
     def insert(self, base_id: int, target_id: int, rate: float):
-        conn, cursor = self._db.get_cursor()
         try:
-            cursor.execute("""
-                INSERT INTO ExchangeRates (baseCurrencyId, targetCurrencyId, rate)
-                VALUES (?, ?, ?);
-            """, (base_id, target_id, rate))
-            conn.commit()
-            return cursor.lastrowid
+            with self._db.transaction() as conn:
+                cursor = conn.execute("""
+                    INSERT INTO ExchangeRates (baseCurrencyId, targetCurrencyId, rate)
+                    VALUES (?, ?, ?);
+                """, (base_id, target_id, rate))
         except sqlite3.IntegrityError as e:
             raise ValueError(
                 f"Rate from {base_id} to {target_id} already exists or currency IDs invalid."
             ) from e
-        finally:
-            conn.close()
+        self._db.notify_write("ExchangeRates", (base_id, target_id))
+        return cursor.lastrowid
 
     def set_exchange_rate(self, base_id: int, target_id: int, rate: float):
-        conn, cursor = self._db.get_cursor()
-        try:
-            cursor.execute("""
+        with self._db.transaction() as conn:
+            cursor = conn.execute("""
                 UPDATE ExchangeRates
                 SET rate = ?
                 WHERE baseCurrencyId = ? AND targetCurrencyId = ?;
             """, (rate, base_id, target_id))
-            conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            conn.close()
\ No newline at end of file
+        if cursor.rowcount > 0:
+            self._db.notify_write("ExchangeRates", (base_id, target_id))
+            return True
+        return False
+
+    def upsert_many(self, rows):
+        """
+        Inserts or updates many (base_id, target_id, rate) rows in one transaction.
+        Returns "created" or "updated" for each row, in order.
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+        base_ids = sorted({row[0] for row in rows})
+        with self._db.transaction() as conn:
+            placeholders = ", ".join("?" * len(base_ids))
+            cursor = conn.execute(
+                f"""
+                SELECT baseCurrencyId, targetCurrencyId
+                FROM ExchangeRates
+                WHERE baseCurrencyId IN ({placeholders});
+                """,
+                base_ids
+            )
+            existing = set(cursor.fetchall())
+            conn.executemany("""
+                INSERT INTO ExchangeRates (baseCurrencyId, targetCurrencyId, rate)
+                VALUES (?, ?, ?)
+                ON CONFLICT(baseCurrencyId, targetCurrencyId) DO UPDATE SET rate = excluded.rate;
+            """, rows)
+
+        statuses = []
+        for base_id, target_id, _ in rows:
+            pair = (base_id, target_id)
+            statuses.append("updated" if pair in existing else "created")
+            existing.add(pair)
+        for pair in dict.fromkeys((row[0], row[1]) for row in rows):
+            self._db.notify_write("ExchangeRates", pair)
+        return statuses
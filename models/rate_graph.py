@@ -0,0 +1,135 @@
+import threading
+from collections import deque
+from models.db import DB
+from models.exchange_rates_dao import ExchangeRatesDAO
+
+class RateGraph:
+    """
+    In-memory graph of all exchange rates, used to find cross rates.
+
+    Every stored pair A -> B is usable in both directions (B -> A as 1 / rate,
+    unless B -> A is stored itself). The rate between two currencies follows
+    the path with the fewest hops, at most max_hops long. Found rates are
+    cached per pair; any rate write marks the graph stale and it is rebuilt
+    from ExchangeRatesDAO on the next lookup.
+    """
+    def __init__(self, exchange_rates_dao: ExchangeRatesDAO, db: DB, max_hops: int = 4):
+        self._exchange_rates_dao = exchange_rates_dao
+        self._db = db
+        self._max_hops = max_hops
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._built_generation = -1
+        self._edges = {}
+        self._rates = {}
+        self.hits = 0
+        self.misses = 0
+        db.add_write_listener(self._on_write)
+
+    def _on_write(self, table, key):
+        if table is None or table == "ExchangeRates":
+            self.invalidate()
+
+    def invalidate(self):
+        """
+        Drops the graph and all cached paths
+        """
+        self._generation += 1
+
+    def _current(self):
+        self._db.check_external_changes()
+        if self._built_generation != self._generation:
+            with self._lock:
+                generation = self._generation
+                if self._built_generation != generation:
+                    edges = self._build_edges(self._exchange_rates_dao.get_all())
+                    self._edges, self._rates = edges, {}
+                    self._built_generation = generation
+        return self._edges, self._rates
+
+    @staticmethod
+    def _build_edges(rates):
+        edges = {}
+        for _, base_id, target_id, rate in rates:
+            edges.setdefault(target_id, {})[base_id] = 1.0 / rate
+            edges.setdefault(base_id, {})
+        # Stored rates win over inverted ones
+        for _, base_id, target_id, rate in rates:
+            edges[base_id][target_id] = rate
+        return edges
+
+    def get_rate(self, from_id: int, to_id: int):
+        """
+        Returns the rate from_id -> to_id, or None if the currencies are not connected
+        within max_hops
+        """
+        edges, rates = self._current()
+        key = (from_id, to_id)
+        try:
+            rate = rates[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return rate
+        self.misses += 1
+        rate = self._find_rate(edges, from_id, to_id)
+        rates[key] = rate
+        return rate
+
+    def get_rate_at(self, from_id: int, to_id: int, at: float):
+        """
+        Like get_rate(), but on the rates as they were at unix time at.
+        The pair and its reverse are single seeks on the history index; only
+        cross rates need the whole historical graph, built per call and not cached.
+        """
+        if from_id == to_id:
+            return 1.0
+        direct = self._exchange_rates_dao.get_exchange_rate_at(from_id, to_id, at)
+        if direct is not None:
+            return direct["rate"]
+        reverse = self._exchange_rates_dao.get_exchange_rate_at(to_id, from_id, at)
+        if reverse is not None:
+            return 1.0 / reverse["rate"]
+        edges = self._build_edges(self._exchange_rates_dao.get_all_at(at))
+        return self._find_rate(edges, from_id, to_id)
+
+    def get_rates_from(self, from_id: int):
+        """
+        Returns {to_id: rate} for every currency reachable from from_id, in one traversal
+        """
+        edges, rates = self._current()
+        found = self._traverse(edges, from_id)
+        for to_id, rate in found.items():
+            rates[(from_id, to_id)] = rate
+        return found
+
+    def _traverse(self, edges, from_id, to_id=None):
+        """
+        Breadth-first search, so every currency is first reached by a path with
+        the fewest hops. Stops early once to_id is reached.
+        """
+        found = {from_id: 1.0}
+        if from_id not in edges:
+            return found
+        frontier = deque([(from_id, 0)])
+        while frontier:
+            node, hops = frontier.popleft()
+            if hops == self._max_hops:
+                continue
+            node_rate = found[node]
+            for neighbour, rate in edges[node].items():
+                if neighbour in found:
+                    continue
+                found[neighbour] = node_rate * rate
+                if neighbour == to_id:
+                    return found
+                frontier.append((neighbour, hops + 1))
+        return found
+
+    def _find_rate(self, edges, from_id, to_id):
+        if from_id == to_id:
+            return 1.0
+        if from_id not in edges or to_id not in edges:
+            return None
+        return self._traverse(edges, from_id, to_id).get(to_id)
@@ -0,0 +1,12 @@
+from collections import namedtuple
+
+# Rows handed out by the DAOs. A named tuple is built straight from the
+# sqlite3 row, takes no per-instance dict and cannot be modified, which
+# matters for the records shared by the CurrencyDAO registry.
+
+Currency = namedtuple("Currency", ("id", "code", "fullname", "sign"))
+
+ExchangeRate = namedtuple("ExchangeRate", ("id", "base_currency_id", "target_currency_id", "rate"))
+
+# A rate joined with its currencies; rows of one listing share their Currency records
+ExchangeRateWithCurrencies = namedtuple("ExchangeRateWithCurrencies", ("id", "rate", "base_currency", "target_currency"))
@@ -1,23 +1,194 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler
+import io
 import json
 import os
+import time
 from models.currency_dao import CurrencyDAO
 from models.exchange_rates_dao import ExchangeRatesDAO
 from models.db import DB
+from models.rate_graph import RateGraph
+from database_setup import DatabaseCreator
 from controllers.currency_controller import CurrencyController
 from controllers.exchange_rate_controller import ExchangeRateController
 from controllers.exchange_controller import ExchangeController
+from server.compression import send_body
+from server.metrics import Metrics
+from server.pool import DetachableHTTPServer, WorkerPoolHTTPServer, pool_settings_from_env
+from server.prefork import PreforkServer, processes_from_env
+from server.profiling import RequestProfiler
+from server.response_cache import ResponseCache
+from server.router import MethodNotAllowed, NotFound, Router
+from server.sse import RateStream
+from server.static import StaticFile
 
-db = DB("currency_exchange.db")
-currency_dao = CurrencyDAO(db)
-exchange_rates_dao = ExchangeRatesDAO(db)
+DB_PATH = os.environ.get("DB_PATH", "currency_exchange.db")
 
-currency_controller = CurrencyController(currency_dao)
-exchange_rate_controller = ExchangeRateController(exchange_rates_dao, currency_dao)
-exchange_controller = ExchangeController(currency_dao, exchange_rates_dao)
+
+class App:
+    """
+    Everything one server process works with: the database connections, DAOs,
+    caches, metrics, controllers and the route table. In pre-fork mode every
+    worker builds its own App after the fork, so nothing is shared between
+    processes; the caches notice the other workers' writes through
+    DB.check_external_changes(). The handler reaches it as self.server.app.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        sync_interval = float(os.environ.get("REPLICA_SYNC_INTERVAL", 0))
+        self.db = DB(
+            db_path,
+            in_memory_replica=os.environ.get("DB_MEMORY_REPLICA", "0").lower() in ("1", "true", "yes"),
+            replica_sync_interval=sync_interval if sync_interval > 0 else None
+        )
+        self.currency_dao = CurrencyDAO(self.db)
+        self.exchange_rates_dao = ExchangeRatesDAO(self.db)
+        self.rate_graph = RateGraph(self.exchange_rates_dao, self.db,
+                                    max_hops=int(os.environ.get("MAX_EXCHANGE_HOPS", 4)))
+        self.response_cache = ResponseCache(self.db, max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", 1024)))
+        # frontend.html из памяти; URL API подставляется один раз при загрузке файла
+        self.welcome_page = StaticFile(
+            "frontend.html", "text/html; charset=utf-8",
+            rewrite=lambda content: content.replace(
+                b"const API_BASE_URL = 'your url';",
+                b"const API_BASE_URL = window.location.origin;"
+            )
+        )
+        self.rate_stream = RateStream(self.exchange_rates_dao, self.currency_dao, self.db,
+                                      max_clients=int(os.environ.get("MAX_STREAM_CLIENTS", 1000)))
+        self.metrics = self._create_metrics()
+        # None, если профилирование не включено (PROFILE_SAMPLE_RATE / PROFILE_TOKEN)
+        self.profiler = RequestProfiler.from_env()
+
+        self.currency_controller = CurrencyController(self.currency_dao, self.response_cache)
+        self.exchange_rate_controller = ExchangeRateController(
+            self.exchange_rates_dao, self.currency_dao, self.response_cache, self.rate_stream
+        )
+        self.exchange_controller = ExchangeController(self.currency_dao, self.exchange_rates_dao, self.rate_graph,
+                                                      self.response_cache)
+        self.router = self._create_router()
+
+    def _create_metrics(self):
+        metrics = Metrics()
+        metrics.describe("http_requests_total", "counter", "HTTP requests by method, route and status")
+        metrics.describe("http_request_duration_seconds", "histogram", "Time spent handling a request, by route")
+        metrics.describe("http_requests_in_flight", "gauge", "Requests being handled right now")
+        metrics.instrument(self.currency_dao, "CurrencyDAO", ("reload", "insert", "update_by_code"))
+        metrics.instrument(self.exchange_rates_dao, "ExchangeRatesDAO")
+        caches = (("response", self.response_cache), ("rate_graph", self.rate_graph))
+        metrics.add_callback("cache_hits_total", "counter", "Cache lookups answered from the cache",
+                             lambda: [((("cache", name),), cache.hits) for name, cache in caches])
+        metrics.add_callback("cache_misses_total", "counter", "Cache lookups that had to compute the value",
+                             lambda: [((("cache", name),), cache.misses) for name, cache in caches])
+        metrics.add_callback("cache_hit_ratio", "gauge", "Share of cache lookups answered from the cache",
+                             lambda: [((("cache", name),), cache.hits / max(cache.hits + cache.misses, 1))
+                                      for name, cache in caches])
+        metrics.add_callback("stream_clients", "gauge", "Open /stream/rates connections",
+                             lambda: [((), self.rate_stream.client_count)])
+        return metrics
+
+    def _create_router(self):
+        router = Router()
+        # Главная страница с документацией
+        router.add("GET", "/", MyServer._send_welcome_page)
+        router.add("GET", "", MyServer._send_welcome_page)
+        router.add("GET", "/frontend.html", MyServer._send_welcome_page)
+        # Валюты
+        router.add("GET", "/currencies", self.currency_controller.handle_get_currencies)
+        router.add("POST", "/currencies", self.currency_controller.handle_post_currencies)
+        router.add("GET", "/currency/", self.currency_controller.handle_get_currency_by_code)
+        router.add("GET", "/currency/{code}", self.currency_controller.handle_get_currency_by_code)
+        # Обменные курсы; пары неверной длины попадают в {pair} и получают 400
+        rates = self.exchange_rate_controller
+        router.add("GET", "/exchangeRates", rates.handle_get_exchange_rates)
+        router.add("POST", "/exchangeRates", rates.handle_post_exchange_rates)
+        router.add("POST", "/exchangeRates/bulk", rates.handle_post_exchange_rates_bulk)
+        for pattern in ("/exchangeRate/", "/exchangeRate/{base:3}{target:3}", "/exchangeRate/{pair}"):
+            router.add("GET", pattern, rates.handle_get_exchange_rate_by_codes)
+            router.add("PATCH", pattern, rates.handle_patch_exchange_rate)
+        for pattern in ("/exchangeRate/{base:3}{target:3}/history", "/exchangeRate/{pair}/history"):
+            router.add("GET", pattern, rates.handle_get_exchange_rate_history)
+        for pattern in ("/exchangeRate/{base:3}{target:3}/ohlc", "/exchangeRate/{pair}/ohlc"):
+            router.add("GET", pattern, rates.handle_get_exchange_rate_ohlc)
+        # Конвертация
+        router.add("GET", "/exchange", self.exchange_controller.handle_exchange)
+        router.add("POST", "/exchange/batch", self.exchange_controller.handle_exchange_batch)
+        router.add("GET", "/exchangeMatrix", self.exchange_controller.handle_get_exchange_matrix)
+        # Метрики
+        router.add("GET", "/metrics", MyServer._send_metrics)
+        if self.profiler is not None:
+            router.add("GET", "/admin/profile", MyServer._send_profile)
+        # Поток изменений курсов
+        router.add("GET", "/stream/rates", rates.handle_stream_rates)
+        return router
+
+    def close(self):
+        self.db.close()
 
 
 class MyServer(BaseHTTPRequestHandler):
+    # Keep-alive: every response carries Content-Length, idle connections are
+    # dropped after `timeout` seconds and after max_requests requests; with a
+    # worker pool they wait for their next request without holding a worker
+    protocol_version = "HTTP/1.1"
+    timeout = float(os.environ.get("KEEPALIVE_TIMEOUT", 5))
+    max_requests = int(os.environ.get("KEEPALIVE_MAX_REQUESTS", 100))
+    max_body_bytes = 16 * 1024 * 1024
+    # Headers and body leave in one segment instead of waiting on delayed ACKs
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+
+    def setup(self):
+        super().setup()
+        self.app = self.server.app
+        self.keep_alive = False
+        self.requests_handled = 0
+        self._connection_header_sent = False
+        self._interim_response = False
+        if isinstance(self.server, WorkerPoolHTTPServer):
+            self.requests_handled = self.server.requests_served(self.request)
+
+    def handle(self):
+        """
+        Serves requests until the connection closes or, with a worker pool,
+        until it goes idle: then keep_alive is set and the pool waits for the
+        next request on its selector.
+        """
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if isinstance(self.server, WorkerPoolHTTPServer) and not self._has_buffered_request():
+                self.keep_alive = True
+                return
+            self.handle_one_request()
+
+    def _has_buffered_request(self):
+        """True if data of the next request is already readable, e.g. a pipelined request"""
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "connection":
+            self._connection_header_sent = True
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        # Tell the client whether the connection stays open: HTTP/1.0 clients
+        # only keep it when told so, HTTP/1.1 ones unless told otherwise
+        # A 1xx such as 100 Continue is followed by the final response on the same connection
+        if not self._connection_header_sent and not self._interim_response:
+            if self.close_connection or self.requests_handled >= self.max_requests:
+                self.send_header("Connection", "close")
+            elif self.request_version != "HTTP/1.1":
+                self.send_header("Connection", "keep-alive")
+        super().end_headers()
+        if self._interim_response:
+            # wfile is buffered, and the client waits for this before sending the body
+            self.wfile.flush()
 
     def _set_cors_headers(self):
         """Устанавливает CORS заголовки для всех ответов"""
@@ -28,140 +199,246 @@ class MyServer(BaseHTTPRequestHandler):
 
     def do_OPTIONS(self):
         """Обработка preflight запросов"""
-        self.send_response(200)
-        self._set_cors_headers()
-        self.end_headers()
+        self.requests_handled += 1
+        connection_stream = self.rfile
+        try:
+            if not self._read_request_body():
+                return
+            self.send_response(200)
+            self._set_cors_headers()
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        finally:
+            self.rfile = connection_stream
 
     def do_GET(self):
-        try:
-            # Главная страница с документацией
-            if self.path == "/" or self.path == "":
-                self._send_welcome_page()
-            
-            # Валюты
-            elif self.path == "/currencies":
-                currency_controller.handle_get_currencies(self)
-            elif self.path.startswith("/currency/"):
-                currency_controller.handle_get_currency_by_code(self)
-            
-            # Обменные курсы
-            elif self.path == "/exchangeRates":
-                exchange_rate_controller.handle_get_exchange_rates(self)
-            elif self.path.startswith("/exchangeRate/"):
-                exchange_rate_controller.handle_get_exchange_rate_by_codes(self)
-            
-            # Конвертация
-            elif self.path.startswith("/exchange"):
-                exchange_controller.handle_exchange(self)
-            
-            else:
-                self._send_error_response(404, "Endpoint not found")
-                
-        except Exception as e:
-            print(f"Unexpected error in GET: {e}")
-            self._send_error_response(500, "Internal server error")
+        self._dispatch("GET")
 
     def do_POST(self):
-        try:
-            if self.path == "/currencies":
-                currency_controller.handle_post_currencies(self)
-            
-            elif self.path == "/exchangeRates":
-                exchange_rate_controller.handle_post_exchange_rates(self)
-            
-            else:
-                self._send_error_response(404, "Endpoint not found")
-                
-        except Exception as e:
-            print(f"Unexpected error in POST: {e}")
-            self._send_error_response(500, "Internal server error")
+        self._dispatch("POST")
 
     def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _read_request_body(self):
+        """
+        Reads the whole request body up front and serves it from memory, so an
+        unread body can never be mistaken for the next request on the connection.
+        Returns False if an error response has been sent instead.
+        """
+        if "Transfer-Encoding" in self.headers:
+            self._send_error_response(411, "Content-Length is required", {"Connection": "close"})
+            return False
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._send_error_response(400, "Invalid Content-Length", {"Connection": "close"})
+            return False
+        if length > self.max_body_bytes:
+            self._send_error_response(413, "Request body is too large", {"Connection": "close"})
+            return False
+        if length:
+            self.rfile = io.BytesIO(self.rfile.read(length))
+        return True
+
+    def _dispatch(self, method):
+        self.requests_handled += 1
+        self._status = None
+        route_name = "unmatched"
+        started = time.perf_counter()
+        metrics, profiler = self.app.metrics, self.app.profiler
+        metrics.inc("http_requests_in_flight", (), 1)
+        connection_stream = self.rfile
         try:
-            if self.path.startswith("/exchangeRate/"):
-                exchange_rate_controller.handle_patch_exchange_rate(self)
-            
-            else:
-                self._send_error_response(404, "Endpoint not found")
-                
-        except Exception as e:
-            print(f"Unexpected error in PATCH: {e}")
-            self._send_error_response(500, "Internal server error")
-
-    def _send_error_response(self, status_code, message):
+            if not self._read_request_body():
+                return
+            try:
+                try:
+                    route, path_params, query_params = self.app.router.resolve(method, self.path)
+                except NotFound:
+                    self._send_error_response(404, "Endpoint not found")
+                    return
+                except MethodNotAllowed as e:
+                    self._send_error_response(405, "Method not allowed", {"Allow": ", ".join(e.allowed)})
+                    return
+                route_name = route.__name__
+                if profiler is not None and profiler.wants(self):
+                    profiler.run(route_name, route, self, path_params, query_params)
+                else:
+                    route(self, path_params, query_params)
+                    
+            except Exception as e:
+                print(f"Unexpected error in {method}: {e}")
+                self._send_error_response(500, "Internal server error")
+        finally:
+            self.rfile = connection_stream
+            if self.requests_handled >= self.max_requests:
+                self.close_connection = True
+            metrics.inc("http_requests_in_flight", (), -1)
+            metrics.observe("http_request_duration_seconds", (("route", route_name),), time.perf_counter() - started)
+            metrics.inc("http_requests_total", (("method", method), ("route", route_name), ("status", str(self._status))))
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def send_response_only(self, code, message=None):
+        # Also reached directly by handle_expect_100(), without send_response()
+        self._connection_header_sent = False
+        self._interim_response = code < 200
+        super().send_response_only(code, message)
+
+    def _send_metrics(self, path_params=None, query_params=None):
+        """Метрики в текстовом формате Prometheus"""
+        body = self.app.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        send_body(self, body)
+
+    def _send_profile(self, path_params=None, query_params=None):
+        """Профили запросов: ?format=text|pstats|collapsed&route={route}&reset=1"""
+        profiler = self.app.profiler
+        if not profiler.is_admin(self):
+            self._send_error_response(403, "Forbidden")
+            return
+        output_format = query_params['format'][0] if 'format' in query_params else "text"
+        if output_format not in ("text", "pstats", "collapsed"):
+            self._send_error_response(400, "Parameter 'format' must be one of: text, pstats, collapsed")
+            return
+        route_name = query_params['route'][0] if 'route' in query_params else None
+        body = profiler.render(output_format, route_name)
+        if 'reset' in query_params:
+            profiler.reset()
+        if body is None:
+            self._send_error_response(404, "No profiled requests")
+            return
+        self.send_response(200)
+        if output_format == "pstats":
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Disposition", 'attachment; filename="profile.pstats"')
+        else:
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Cache-Control", "no-store")
+        send_body(self, body)
+
+    def _send_error_response(self, status_code, message, headers=None):
         error_response = {"message": message}
+        body = json.dumps(error_response, ensure_ascii=False).encode('utf-8')
         self.send_response(status_code)
         self.send_header("Content-Type", "application/json; charset=utf-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self._set_cors_headers()
-        self.end_headers()
-        self.wfile.write(json.dumps(error_response, ensure_ascii=False).encode('utf-8'))
+        send_body(self, body)
 
-    def _send_welcome_page(self):
+    def _send_welcome_page(self, path_params=None, query_params=None):
         """Отдаёт ваш frontend.html на главной странице"""
-        try:
-            with open('frontend.html', 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Автоматически подставляем URL API (текущий домен)
-            content = content.replace(
-                "const API_BASE_URL = 'your url';",
-                "const API_BASE_URL = window.location.origin;"
-            )
-            
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self._set_cors_headers()
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
-            
-        except FileNotFoundError:
-            error_html = """
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <title>Error - Frontend Not Found</title>
-                <style>
-                    body { font-family: Arial, sans-serif; padding: 50px; text-align: center; }
-                    h1 { color: #dc3545; }
-                    .info { background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px auto; max-width: 600px; }
-                    a { color: #667eea; text-decoration: none; font-weight: bold; }
-                    a:hover { text-decoration: underline; }
-                </style>
-            </head>
-            <body>
-                <h1>⚠️ Error: frontend.html not found</h1>
-                <div class="info">
-                    <p>Please make sure <code>frontend.html</code> is in the same directory as myServer.py</p>
-                    <p>Meanwhile, you can test the API directly:</p>
-                    <p><a href="/currencies">📋 View all currencies</a></p>
-                    <p><a href="/exchangeRates">💱 View exchange rates</a></p>
-                </div>
-            </body>
-            </html>
-            """
-            self.send_response(404)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self._set_cors_headers()
-            self.end_headers()
-            self.wfile.write(error_html.encode('utf-8'))
+        if self.app.welcome_page.serve(self):
+            return
+        
+        error_html = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <title>Error - Frontend Not Found</title>
+            <style>
+                body { font-family: Arial, sans-serif; padding: 50px; text-align: center; }
+                h1 { color: #dc3545; }
+                .info { background: #f8f9fa; padding: 20px; border-radius: 8px; margin: 20px auto; max-width: 600px; }
+                a { color: #667eea; text-decoration: none; font-weight: bold; }
+                a:hover { text-decoration: underline; }
+            </style>
+        </head>
+        <body>
+            <h1>⚠️ Error: frontend.html not found</h1>
+            <div class="info">
+                <p>Please make sure <code>frontend.html</code> is in the same directory as myServer.py</p>
+                <p>Meanwhile, you can test the API directly:</p>
+                <p><a href="/currencies">📋 View all currencies</a></p>
+                <p><a href="/exchangeRates">💱 View exchange rates</a></p>
+            </div>
+        </body>
+        </html>
+        """
+        body = error_html.encode('utf-8')
+        self.send_response(404)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self._set_cors_headers()
+        send_body(self, body)
+
+
+
+def make_server(app, server_address, workers, queue_size, listener=None, handler_class=None):
+    """
+    Creates the HTTP server for app: a worker pool, or the single-threaded
+    server when workers is 0. It binds server_address, or serves on an
+    already listening socket when listener is given (pre-fork workers).
+    """
+    handler_class = handler_class or MyServer
+    if workers > 0:
+        httpd = WorkerPoolHTTPServer(server_address, handler_class, workers=workers, queue_size=queue_size,
+                                     bind_and_activate=listener is None, idle_timeout=handler_class.timeout)
+    else:
+        httpd = DetachableHTTPServer(server_address, handler_class, bind_and_activate=listener is None)
+    if listener is not None:
+        httpd.socket.close()
+        httpd.socket = listener
+        httpd.server_address = listener.getsockname()
+    httpd.app = app
+    return httpd
 
 
 def run():
     port = int(os.environ.get("PORT", 8000))
     server_address = ("0.0.0.0", port)
-    httpd = HTTPServer(server_address, MyServer)
-    print(f"Server started on port {port}")
+    workers, queue_size = pool_settings_from_env()
+    processes, reuse_port = processes_from_env()
+    # Схема создаётся один раз, до запуска воркеров
+    DatabaseCreator(DB_PATH).create_schema()
+    if processes > 1:
+        def serve_worker(listener):
+            make_server(App(), server_address, workers, queue_size, listener=listener).serve_forever()
+
+        httpd = PreforkServer(server_address, serve_worker, processes, reuse_port=reuse_port,
+                              backlog=max(queue_size, 5))
+        print(f"Server started on port {port} ({processes} processes"
+              f"{' with SO_REUSEPORT' if reuse_port else ''}, {workers} workers each)")
+    else:
+        httpd = make_server(App(), server_address, workers, queue_size)
+        if workers > 0:
+            print(f"Server started on port {port} ({workers} workers, queue size {queue_size})")
+        else:
+            print(f"Server started on port {port}")
     print("Available endpoints:")
     print("  GET    /")
+    print("  GET    /frontend.html")
     print("  GET    /currencies")
     print("  GET    /currency/{code}")
     print("  POST   /currencies")
     print("  GET    /exchangeRates")
     print("  GET    /exchangeRate/{basecode}{targetcode}")
+    print("  GET    /exchangeRate/{basecode}{targetcode}/history?from={time}&to={time}")
+    print("  GET    /exchangeRate/{basecode}{targetcode}/ohlc?interval={1m|1h|1d}")
     print("  POST   /exchangeRates")
     print("  PATCH  /exchangeRate/{basecode}{targetcode}")
-    print("  GET    /exchange?from={code}&to={code}&amount={amount}")
+    print("  POST   /exchangeRates/bulk")
+    print("  GET    /exchange?from={code}&to={code}&amount={amount}[&at={time}]")
+    print("  POST   /exchange/batch")
+    print("  GET    /exchangeMatrix?codes={code},{code},...")
+    print("  GET    /stream/rates[?pairs={pair},{pair},...]")
+    print("  GET    /metrics")
+    if RequestProfiler.from_env() is not None:
+        print("  GET    /admin/profile?format={text|pstats|collapsed}[&route={route}]")
     httpd.serve_forever()
 
 
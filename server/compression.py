@@ -0,0 +1,82 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent as they are: the saving would not pay for the CPU
+MIN_COMPRESS_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+
+
+class CachedBody(bytes):
+    """
+    Response body that is sent many times, e.g. one kept in the ResponseCache.
+    Its compressed variants are kept in .variants, so each is built only once.
+    """
+
+    def __new__(cls, body):
+        self = super().__new__(cls, body)
+        self.variants = {}
+        return self
+
+
+def choose_encoding(accept_encoding):
+    """
+    Picks "br", "gzip" or None (identity) from an Accept-Encoding header
+    """
+    if not accept_encoding:
+        return None
+    offered = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip().lower()] = quality
+    wildcard = offered.get("*", 0.0)
+    if brotli is not None and offered.get("br", wildcard) > 0:
+        return "br"
+    if offered.get("gzip", offered.get("x-gzip", wildcard)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding, best=False):
+    """
+    Compresses body. best=True spends far more CPU, for bodies compressed once
+    for the life of the process such as static files; cached API responses are
+    rebuilt after every write and use the moderate default.
+    """
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else 5)
+    return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+
+
+def send_body(handler, body):
+    """
+    Ends the headers and writes body, compressed if the client accepts it and
+    the body is large enough. Adds Content-Encoding, Vary and Content-Length.
+    """
+    encoding = None
+    if len(body) >= MIN_COMPRESS_BYTES:
+        encoding = choose_encoding(handler.headers.get("Accept-Encoding"))
+    if encoding is not None:
+        variants = getattr(body, "variants", None)
+        if variants is None:
+            body = compress(body, encoding)
+        else:
+            encoded = variants.get(encoding)
+            if encoded is None:
+                encoded = variants[encoding] = compress(body, encoding)
+            body = encoded
+        handler.send_header("Content-Encoding", encoding)
+    handler.send_header("Vary", "Accept-Encoding")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
@@ -0,0 +1,52 @@
+import email.utils
+
+
+def make_etag(token):
+    return f'W/"{token}"'
+
+
+def _strip_weak(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def send_validators(handler, etag, last_modified):
+    """Adds the ETag / Last-Modified headers to a 200 response"""
+    handler.send_header("ETag", etag)
+    handler.send_header("Last-Modified", email.utils.formatdate(last_modified, usegmt=True))
+    handler.send_header("Cache-Control", "no-cache")
+
+
+def send_not_modified_if_fresh(handler, etag, last_modified):
+    """
+    Answers 304 Not Modified and returns True when the client's copy is current
+    (If-None-Match takes precedence over If-Modified-Since)
+    """
+    if_none_match = handler.headers.get("If-None-Match")
+    if if_none_match is not None:
+        wanted = _strip_weak(etag)
+        fresh = any(
+            tag.strip() == "*" or _strip_weak(tag) == wanted
+            for tag in if_none_match.split(",")
+        )
+    else:
+        if_modified_since = handler.headers.get("If-Modified-Since")
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        fresh = int(last_modified) <= since
+
+    if not fresh:
+        return False
+    handler.send_response(304)
+    send_validators(handler, etag, last_modified)
+    # Shared caches key the stored encodings on it, so it matches the 200
+    handler.send_header("Vary", "Accept-Encoding")
+    handler.send_header("Access-Control-Allow-Origin", "*")
+    handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS")
+    handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+    handler.end_headers()
+    return True
@@ -0,0 +1,147 @@
+import bisect
+import functools
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(labels, extra=""):
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms rendered in the Prometheus text format.
+
+    Every thread records into its own shard, so the hot path takes no lock:
+    a counter is a one-element list and a histogram a pre-allocated list of
+    bucket counts plus sum. render() adds the shards up. Values that other
+    objects already count (cache hits, ...) are read through callbacks
+    registered with add_callback().
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        # name -> (type, help)
+        self._families = {}
+        self._callbacks = []
+
+    def describe(self, name, metric_type, help_text):
+        self._families[name] = (metric_type, help_text)
+
+    def add_callback(self, name, metric_type, help_text, callback):
+        """callback() -> [(labels, value)] is called on every render"""
+        self.describe(name, metric_type, help_text)
+        self._callbacks.append((name, callback))
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def inc(self, name, labels=(), amount=1):
+        """Adds amount to a counter (or, with a negative amount, to a gauge)"""
+        shard = self._shard()
+        key = (name, labels)
+        cell = shard.get(key)
+        if cell is None:
+            cell = shard[key] = [0]
+        cell[0] += amount
+
+    def observe(self, name, labels, value):
+        """Records value in a histogram"""
+        shard = self._shard()
+        key = (name, labels)
+        cell = shard.get(key)
+        if cell is None:
+            # bucket counts, +Inf count, sum
+            cell = shard[key] = [0] * (len(self._buckets) + 1) + [0.0]
+        cell[bisect.bisect_left(self._buckets, value)] += 1
+        cell[-1] += value
+
+    def timed(self, name, labels, func):
+        """Wraps func so that each call is observed in the histogram name"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(name, labels, time.perf_counter() - started)
+        return wrapper
+
+    def _collect(self):
+        totals = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for key, cell in list(shard.items()):
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = list(cell)
+                else:
+                    for i, value in enumerate(cell):
+                        total[i] += value
+        return totals
+
+    def render(self):
+        by_family = {}
+        for (name, labels), cell in self._collect().items():
+            by_family.setdefault(name, []).append((labels, cell))
+        for name, callback in self._callbacks:
+            by_family[name] = [(labels, [value]) for labels, value in callback()]
+
+        lines = []
+        for name in sorted(by_family):
+            metric_type, help_text = self._families.get(name, ("untyped", ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, cell in sorted(by_family[name], key=lambda item: item[0]):
+                if metric_type != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(cell[0])}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self._buckets + (float("inf"),), cell):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _format_labels(labels, 'le="' + le + '"')
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(cell[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def instrument(self, obj, component, methods=None):
+        """
+        Replaces the public methods of obj (or the listed ones) with wrappers that
+        count and time every call as db_call_duration_seconds{dao=component,method=...}
+        """
+        self.describe("db_call_duration_seconds", "histogram", "Duration of DAO method calls")
+        if methods is None:
+            methods = [
+                name for name, value in vars(type(obj)).items()
+                if not name.startswith("_") and callable(value)
+            ]
+        for method in methods:
+            setattr(obj, method, self.timed(
+                "db_call_duration_seconds", (("dao", component), ("method", method)), getattr(obj, method)
+            ))
@@ -0,0 +1,68 @@
+import datetime
+import math
+import urllib.parse
+
+
+def parse_timestamp(value):
+    """
+    Parses unix seconds or an ISO 8601 date/time (UTC unless an offset is given)
+    into unix seconds. Raises ValueError for anything else.
+    """
+    value = value.strip()
+    try:
+        timestamp = float(value)
+    except ValueError:
+        moment = datetime.datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        timestamp = moment.timestamp()
+    if not math.isfinite(timestamp):
+        raise ValueError(f"Invalid timestamp '{value}'")
+    return timestamp
+
+
+def format_timestamp(timestamp):
+    """Formats unix seconds as ISO 8601 UTC with milliseconds, e.g. 2024-01-31T12:00:00.000Z"""
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def parse_page(query_params, default_limit, max_limit):
+    """
+    Returns (limit, after) from the ?limit=&after= keyset parameters of a list:
+    at most limit items whose id is greater than after.
+    Raises ValueError with a message for the client on bad values.
+    """
+    try:
+        limit = int(query_params['limit'][0]) if 'limit' in query_params else default_limit
+        if not 0 < limit <= max_limit:
+            raise ValueError
+    except ValueError:
+        raise ValueError(f"Parameter 'limit' must be between 1 and {max_limit}") from None
+    try:
+        after = int(query_params['after'][0]) if 'after' in query_params else 0
+        if after < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Parameter 'after' must be a non-negative id") from None
+    return limit, after
+
+
+def parse_codes(query_params, name):
+    """
+    Returns the set of currency codes in ?name=USD,EUR, or None if the parameter is absent.
+    Raises ValueError if it is present but empty.
+    """
+    if name not in query_params:
+        return None
+    codes = {code.strip().upper() for code in query_params[name][0].split(",") if code.strip()}
+    if not codes:
+        raise ValueError(f"Parameter '{name}' is empty")
+    return codes
+
+
+def next_page_link(path, query_params, after):
+    """Link header value pointing at the page that follows the item with id after"""
+    params = {name: values[0] for name, values in query_params.items()}
+    params['after'] = str(after)
+    return f'<{path}?{urllib.parse.urlencode(params, safe=",")}>; rel="next"'
@@ -0,0 +1,227 @@
+import os
+import queue
+import selectors
+import socket
+import threading
+import time
+from http.server import HTTPServer
+
+
+class DetachableHTTPServer(HTTPServer):
+    """
+    HTTPServer that lets a handler keep its connection open after it returns,
+    e.g. to hand a streaming client over to another thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def detach_request(self, request):
+        """The server will neither shut down nor close this connection"""
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+
+class WorkerPoolHTTPServer(DetachableHTTPServer):
+    """
+    HTTPServer that hands connections to a fixed pool of worker threads.
+
+    Idle connections wait on a selector thread and are queued for a worker
+    only once they become readable, so an idle keep-alive client holds no
+    worker. When the bounded queue is full the connection is answered with
+    503 right away instead of piling up behind slow requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, workers=8, queue_size=64,
+                 bind_and_activate=True, idle_timeout=5.0):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        # The listen backlog follows the accept queue so the kernel does not
+        # hold far more connections than we are willing to serve.
+        self.request_queue_size = max(queue_size, 5)
+        self._requests = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        # sock -> deadline of the connections waiting on the selector, closed once it passes
+        self._idle = {}
+        self._idle_pending = []
+        self._idle_lock = threading.Lock()
+        # sock -> requests answered on the connection so far, see requests_served()
+        self._served = {}
+        self._idle_selector = selectors.DefaultSelector()
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+        self._idle_selector.register(self._wake_reader, selectors.EVENT_READ, None)
+        self._closing = False
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self._start_workers()
+
+    def _start_workers(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name=f"http-worker-{i}",
+                daemon=self.daemon_threads
+            )
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._idle_loop, name="http-idle", daemon=self.daemon_threads)
+        thread.start()
+        self._threads.append(thread)
+
+    def _worker_loop(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            handler = None
+            try:
+                handler = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            # A handler that leaves the connection open and idle sets keep_alive
+            if getattr(handler, "keep_alive", False):
+                self._park(request, client_address, handler.requests_handled)
+            else:
+                self.shutdown_request(request)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def requests_served(self, request):
+        """How many requests earlier handlers answered on this connection"""
+        return self._served.pop(request, 0)
+
+    def process_request(self, request, client_address):
+        """Wait for the request on the selector instead of handling it inline"""
+        self._park(request, client_address)
+
+    def _park(self, request, client_address, requests_handled=0):
+        if requests_handled:
+            self._served[request] = requests_handled
+        with self._idle_lock:
+            self._idle_pending.append((request, client_address))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _enqueue(self, request, client_address):
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            self._served.pop(request, None)
+            self._reject(request)
+
+    def _idle_loop(self):
+        next_expiry = time.monotonic() + self.idle_timeout
+        while not self._closing:
+            for key, _ in self._idle_selector.select(min(self.idle_timeout, 1.0)):
+                if key.data is None:
+                    try:
+                        while self._wake_reader.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                self._idle_selector.unregister(key.fileobj)
+                del self._idle[key.fileobj]
+                self._enqueue(key.fileobj, key.data)
+
+            with self._idle_lock:
+                pending, self._idle_pending = self._idle_pending, []
+            now = time.monotonic()
+            for request, client_address in pending:
+                try:
+                    self._idle_selector.register(request, selectors.EVENT_READ, client_address)
+                except (ValueError, OSError):
+                    # Closed by the peer and already invalid
+                    self._close_idle(request)
+                    continue
+                self._idle[request] = now + self.idle_timeout
+
+            if now >= next_expiry:
+                next_expiry = now + min(self.idle_timeout, 1.0)
+                for request in [request for request, deadline in self._idle.items() if deadline <= now]:
+                    self._idle_selector.unregister(request)
+                    del self._idle[request]
+                    self._close_idle(request)
+
+        for request in list(self._idle):
+            self._idle_selector.unregister(request)
+            self._close_idle(request)
+        self._idle.clear()
+        with self._idle_lock:
+            pending, self._idle_pending = self._idle_pending, []
+        for request, _ in pending:
+            self._close_idle(request)
+
+    def _close_idle(self, request):
+        self._served.pop(request, None)
+        self.shutdown_request(request)
+
+    def _reject(self, request):
+        body = b'{"message": "Server is busy"}'
+        try:
+            request.sendall(
+                b"HTTP/1.0 503 Service Unavailable\r\n"
+                b"Content-Type: application/json; charset=utf-8\r\n"
+                b"Access-Control-Allow-Origin: *\r\n"
+                b"Retry-After: 1\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                b"Connection: close\r\n\r\n" + body
+            )
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        workers, idle_thread = self._threads[:-1], self._threads[-1]
+        for _ in workers:
+            self._requests.put(None)
+        for thread in workers:
+            thread.join()
+        self._closing = True
+        self._wake()
+        idle_thread.join()
+        self._threads = []
+        # Connections queued behind the stop markers never reached a worker
+        while True:
+            try:
+                item = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._close_idle(item[0])
+        self._idle_selector.close()
+        self._wake_reader.close()
+        self._wake_writer.close()
+
+
+def pool_settings_from_env():
+    """
+    Returns (workers, queue_size) from the WORKERS and QUEUE_SIZE env vars.
+    WORKERS=0 keeps the old single-threaded server.
+    """
+    workers = int(os.environ.get("WORKERS", 8))
+    queue_size = int(os.environ.get("QUEUE_SIZE", 64))
+    return workers, queue_size
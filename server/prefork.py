@@ -0,0 +1,140 @@
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+# A worker that dies sooner than this after its start is restarted only after a pause
+MIN_WORKER_UPTIME = 1.0
+
+
+def open_listener(server_address, backlog=128, reuse_port=False):
+    """
+    Returns a bound TCP socket, listening unless backlog is None. With
+    reuse_port=True several processes can each open their own socket on the
+    same port (SO_REUSEPORT) and the kernel spreads the incoming connections
+    between the listening ones.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(server_address)
+        if backlog is not None:
+            sock.listen(backlog)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+class PreforkServer:
+    """
+    Supervisor that forks `processes` workers serving the same port.
+
+    By default the supervisor opens the listening socket and the workers
+    inherit it; with reuse_port=True every worker opens its own socket with
+    SO_REUSEPORT instead. worker_main(listener) runs in each child and serves
+    until the process is stopped; it must build everything it uses (database
+    connections, threads, caches) itself, after the fork. A worker that exits
+    is started again, after a pause if it died right after starting.
+    SIGTERM / SIGINT stop the workers and then the supervisor.
+    """
+
+    def __init__(self, server_address, worker_main, processes, reuse_port=False, backlog=128,
+                 restart_delay=1.0):
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        if not hasattr(os, "fork"):
+            raise RuntimeError("pre-fork mode needs os.fork()")
+        self.server_address = server_address
+        self.processes = processes
+        self._worker_main = worker_main
+        self._reuse_port = reuse_port
+        self._backlog = backlog
+        self._restart_delay = restart_delay
+        self._listener = None
+        # pid -> (worker slot, start time)
+        self._children = {}
+        self._stopping = False
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = (slot, time.monotonic())
+            return
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            listener = self._listener
+            if self._reuse_port:
+                listener.close()
+                listener = open_listener(self.server_address, self._backlog, reuse_port=True)
+            self._worker_main(listener)
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    def _stop(self, signum=None, frame=None):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def serve_forever(self):
+        if self._reuse_port:
+            # Bound but not listening: it reserves the port (and picks it when
+            # the port is 0) without being handed any connection
+            self._listener = open_listener(self.server_address, None, reuse_port=True)
+        else:
+            self._listener = open_listener(self.server_address, self._backlog)
+        self.server_address = self._listener.getsockname()
+        previous = {sig: signal.signal(sig, self._stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            for slot in range(self.processes):
+                self._spawn(slot)
+            while self._children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                slot, started = self._children.pop(pid, (None, None))
+                if slot is None or self._stopping:
+                    continue
+                print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting",
+                      file=sys.stderr)
+                if time.monotonic() - started < MIN_WORKER_UPTIME:
+                    time.sleep(self._restart_delay)
+                if not self._stopping:
+                    self._spawn(slot)
+        finally:
+            self._stop()
+            while self._children:
+                try:
+                    self._children.pop(os.wait()[0], None)
+                except ChildProcessError:
+                    break
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+            self._listener.close()
+
+
+def processes_from_env():
+    """
+    Returns (processes, reuse_port) from the PROCESSES and REUSE_PORT env vars.
+    PROCESSES=1 (the default) serves from a single process, 0 starts one per CPU.
+    """
+    processes = int(os.environ.get("PROCESSES", 1))
+    if processes == 0:
+        processes = os.cpu_count() or 1
+    reuse_port = os.environ.get("REUSE_PORT", "0").lower() in ("1", "true", "yes")
+    return processes, reuse_port
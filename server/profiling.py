@@ -0,0 +1,142 @@
+import cProfile
+import hmac
+import io
+import marshal
+import os
+import pstats
+import random
+import threading
+
+# Deepest stack emitted in collapsed output; deeper paths are cut off there
+MAX_COLLAPSED_DEPTH = 64
+
+
+class RequestProfiler:
+    """
+    Runs a sample of requests under cProfile and aggregates the stats per route.
+
+    A request is profiled with probability sample_rate, or always when it
+    carries the X-Profile-Token header with the configured token. Build it
+    with from_env(), which returns None when profiling is not configured, so
+    that a disabled profiler costs the request path a single `is None` test.
+    """
+
+    def __init__(self, sample_rate=0.0, token=None):
+        self._sample_rate = sample_rate
+        self._token = token
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.profiled = 0
+
+    @classmethod
+    def from_env(cls):
+        sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+        token = os.environ.get("PROFILE_TOKEN") or None
+        if sample_rate <= 0 and token is None:
+            return None
+        return cls(sample_rate=min(sample_rate, 1.0), token=token)
+
+    def is_admin(self, handler):
+        """
+        True if the request may read the profiles: it carries the token,
+        or, when no token is configured, it comes from this host
+        """
+        if self._token is None:
+            return handler.client_address[0] in ("127.0.0.1", "::1")
+        offered = handler.headers.get("X-Profile-Token")
+        return offered is not None and hmac.compare_digest(offered, self._token)
+
+    def wants(self, handler):
+        if self._sample_rate and random.random() < self._sample_rate:
+            return True
+        return self._token is not None and "X-Profile-Token" in handler.headers and self.is_admin(handler)
+
+    def run(self, route_name, func, *args):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            with self._lock:
+                stats = self._stats.get(route_name)
+                if stats is None:
+                    self._stats[route_name] = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+                self.profiled += 1
+
+    def routes(self):
+        with self._lock:
+            return sorted(self._stats)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.profiled = 0
+
+    def _merged(self, route_name=None):
+        with self._lock:
+            selected = [
+                stats for name, stats in self._stats.items()
+                if route_name is None or name == route_name
+            ]
+            if not selected:
+                return None
+            merged = pstats.Stats()
+            for stats in selected:
+                merged.add(stats)
+            return merged
+
+    def render(self, output_format="text", route_name=None, limit=50):
+        """
+        Returns the aggregated profile of one route (or all) as bytes, or None if nothing was profiled:
+        "text" is the pstats report by cumulative time, "pstats" a file pstats.Stats() can load,
+        "collapsed" one "frame;frame;frame microseconds" line per stack for flame graph tools.
+        """
+        stats = self._merged(route_name)
+        if stats is None:
+            return None
+        if output_format == "pstats":
+            return marshal.dumps(stats.stats)
+        if output_format == "collapsed":
+            return self._collapsed(stats.stats).encode("utf-8")
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue().encode("utf-8")
+
+    @staticmethod
+    def _collapsed(raw):
+        """
+        cProfile keeps caller -> callee edges, not whole stacks, so stacks are
+        rebuilt from the roots down, splitting each function's time between
+        its callers in proportion to the time spent under each of them.
+        """
+        def label(func):
+            filename, line, name = func
+            return f"{name} ({os.path.basename(filename)}:{line})" if line else name
+
+        callees = {}
+        for func, (_, _, _, _, callers) in raw.items():
+            for caller, edge in callers.items():
+                callees.setdefault(caller, []).append((func, edge[3]))
+        lines = {}
+
+        def visit(func, stack, path_time):
+            _, _, own_time, total_time, _ = raw[func]
+            share = path_time / total_time if total_time > 0 else 0.0
+            stack = stack + [label(func)]
+            key = ";".join(stack)
+            lines[key] = lines.get(key, 0.0) + own_time * share
+            if len(stack) >= MAX_COLLAPSED_DEPTH:
+                return
+            for callee, edge_time in callees.get(func, ()):
+                if label(callee) not in stack and edge_time * share > 0:
+                    visit(callee, stack, edge_time * share)
+
+        for func, (_, _, _, total_time, callers) in raw.items():
+            if not callers:
+                visit(func, [], total_time)
+        return "".join(
+            f"{stack} {round(seconds * 1e6)}\n"
+            for stack, seconds in sorted(lines.items()) if round(seconds * 1e6) > 0
+        )
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict, defaultdict
+
+from server.compression import CachedBody
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of ready-to-send response bodies. Bodies are stored as
+    CachedBody, so their compressed variants live and expire with them.
+
+    Each entry declares what it was built from as a set of dependency markers:
+    "currencies", "rates", ("currency", code) and ("rate", base_id, target_id).
+    DAO writes reported through DB.notify_write() drop exactly the entries that
+    depend on the written row; a change by another process drops everything.
+    """
+
+    def __init__(self, db, max_entries=1024):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # marker -> keys of the entries that depend on it
+        self._keys_by_marker = defaultdict(set)
+        # Bumped by every invalidation, so a body built from data read before
+        # a write is not stored after that write has been reported
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        db.add_write_listener(self._on_write)
+
+    def _on_write(self, table, key):
+        if table == "Currencies":
+            markers = {"currencies", ("currency", key)}
+        elif table == "ExchangeRates":
+            markers = {"rates", ("rate",) + tuple(key)} if key else {"rates"}
+        elif table is None:
+            self.clear()
+            return
+        else:
+            return
+        with self._lock:
+            self._generation += 1
+            for marker in markers:
+                for entry_key in list(self._keys_by_marker.get(marker, ())):
+                    self._remove(entry_key)
+
+    def _remove(self, key):
+        _, deps = self._entries.pop(key)
+        for marker in deps:
+            keys = self._keys_by_marker[marker]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_marker[marker]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_or_build(self, key, build):
+        """
+        Returns the cached body for key, or calls build() -> (body, deps) and caches it.
+        build() may return None for responses that must not be cached.
+        """
+        body = self.get(key)
+        if body is not None:
+            return body
+        generation = self._generation
+        built = build()
+        if built is None:
+            return None
+        body, deps = built
+        body = CachedBody(body)
+        with self._lock:
+            if generation == self._generation:
+                if key in self._entries:
+                    self._remove(key)
+                deps = frozenset(deps)
+                self._entries[key] = (body, deps)
+                for marker in deps:
+                    self._keys_by_marker[marker].add(key)
+                while len(self._entries) > self._max_entries:
+                    self._remove(next(iter(self._entries)))
+        return body
+
+    def clear(self):
+        """
+        Drops every entry, e.g. after a change by another process
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys_by_marker.clear()
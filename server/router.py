@@ -0,0 +1,87 @@
+import re
+import urllib.parse
+from collections import defaultdict
+
+# {name} matches one path segment, {name:3} exactly three characters of one
+_PARAM = re.compile(r"\{(\w+)(?::(\d+))?\}")
+
+
+class NotFound(Exception):
+    """No route matches the path"""
+
+
+class MethodNotAllowed(Exception):
+    """The path exists but not for this method; allowed lists the methods it has"""
+
+    def __init__(self, allowed):
+        super().__init__(f"Allowed: {', '.join(allowed)}")
+        self.allowed = allowed
+
+
+class Router:
+    """
+    Table of routes compiled once at startup.
+
+    Paths without parameters are looked up in a dict. Patterns with parameters
+    are compiled to regexes and grouped by their first segment, so a request
+    is only matched against the few patterns that share it, in the order they
+    were added. A route handler is called as route(handler, path_params, query_params)
+    where query_params is what urllib.parse.parse_qs returns.
+    """
+
+    def __init__(self):
+        self._static = {}
+        self._dynamic = defaultdict(list)
+        self._by_pattern = {}
+
+    def add(self, method, pattern, route):
+        methods = self._by_pattern.get(pattern)
+        if methods is None:
+            methods = self._by_pattern[pattern] = {}
+            if _PARAM.search(pattern):
+                self._dynamic[self._first_segment(pattern)].append((self._compile(pattern), methods))
+            else:
+                self._static[pattern] = methods
+        methods[method] = route
+
+    @staticmethod
+    def _first_segment(path):
+        return path.split("/", 2)[1] if path.startswith("/") else ""
+
+    @staticmethod
+    def _compile(pattern):
+        if _PARAM.search(pattern.split("/", 2)[1]):
+            raise ValueError(f"The first segment of '{pattern}' must be literal")
+        regex = []
+        position = 0
+        for match in _PARAM.finditer(pattern):
+            regex.append(re.escape(pattern[position:match.start()]))
+            name, length = match.groups()
+            regex.append(f"(?P<{name}>[^/]{{{length}}})" if length else f"(?P<{name}>[^/]+)")
+            position = match.end()
+        regex.append(re.escape(pattern[position:]))
+        return re.compile("".join(regex) + r"\Z")
+
+    def resolve(self, method, target):
+        """
+        Returns (route, path_params, query_params) for a request target such as
+        "/exchangeRate/USDEUR?x=1". Raises NotFound or MethodNotAllowed.
+        """
+        path, _, query = target.partition("?")
+        path_params = {}
+        methods = self._static.get(path)
+        if methods is None:
+            for regex, candidate in self._dynamic.get(self._first_segment(path), ()):
+                match = regex.match(path)
+                if match:
+                    methods = candidate
+                    path_params = {
+                        name: urllib.parse.unquote(value) for name, value in match.groupdict().items()
+                    }
+                    break
+            else:
+                raise NotFound(path)
+        route = methods.get(method)
+        if route is None:
+            raise MethodNotAllowed(sorted(methods))
+        return route, path_params, urllib.parse.parse_qs(query)
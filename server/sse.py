@@ -0,0 +1,321 @@
+import json
+import queue
+import selectors
+import socket
+import threading
+import time
+
+from server.params import format_timestamp
+
+
+class _Subscriber:
+    __slots__ = ("sock", "pairs", "buffer", "replay_from", "replay_pending")
+
+    def __init__(self, sock, pairs, replay_from):
+        self.sock = sock
+        self.pairs = pairs
+        self.buffer = bytearray()
+        # Last history id replayed to the subscriber, None once it follows the live events
+        self.replay_from = replay_from
+        self.replay_pending = False
+
+
+class RateStream:
+    """
+    Server-Sent Events fan-out of rate changes.
+
+    Subscribed connections are detached from the HTTP workers and served by a
+    single selector thread, so idle clients cost a socket and a buffer rather
+    than a thread. Events are read from ExchangeRateHistory by a reader
+    thread: immediately after a write through this DB, and every
+    poll_interval seconds to pick up writes made by other processes. A client
+    whose unsent data exceeds max_buffer_bytes is dropped; the events missed
+    before a reconnect are replayed a batch at a time as its buffer drains.
+    """
+
+    def __init__(self, exchange_rates_dao, currency_dao, db, max_clients=1000,
+                 max_buffer_bytes=64 * 1024, heartbeat_interval=15.0, poll_interval=1.0,
+                 replay_batch_rows=5000):
+        self._exchange_rates_dao = exchange_rates_dao
+        self._currency_dao = currency_dao
+        self._max_clients = max_clients
+        self._max_buffer_bytes = max_buffer_bytes
+        self._heartbeat_interval = heartbeat_interval
+        self._poll_interval = poll_interval
+        self._replay_batch_rows = replay_batch_rows
+        self._lock = threading.Lock()
+        self._pending = []
+        self._subscribers = {}
+        # Last event broadcast by the selector thread, and last one read by the reader thread
+        self._last_id = None
+        self._read_id = None
+        self._dirty = False
+        self._publish_queued = False
+        # Reader jobs: None reads new changes, (subscriber, after_id, budget) a replay batch
+        self._reads = queue.Queue()
+        # (function, args) posted by the reader thread to run on the selector thread
+        self._results = []
+        self._thread = None
+        self._selector = None
+        self._wake_reader = self._wake_writer = None
+        self.dropped = 0
+        db.add_write_listener(self._on_write)
+
+    @property
+    def client_count(self):
+        return len(self._subscribers) + len(self._pending)
+
+    def _on_write(self, table, key):
+        if table is None or table == "ExchangeRates":
+            self._dirty = True
+            self._wake()
+
+    def _wake(self):
+        if self._wake_writer is not None:
+            try:
+                self._wake_writer.send(b"\0")
+            except (BlockingIOError, OSError):
+                pass
+
+    def subscribe(self, handler, pairs=None, last_event_id=None):
+        """
+        Sends the event-stream headers and takes the connection over from the handler.
+        pairs is a set of "USDEUR" style codes to filter on, or None for every pair.
+        Returns False (without touching the connection) when the stream is full.
+        """
+        with self._lock:
+            if self.client_count >= self._max_clients:
+                return False
+            self._ensure_started()
+        # Changes committed while the connection is handed over are replayed from here
+        if last_event_id is None:
+            last_event_id = self._exchange_rates_dao.get_last_history_id()
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.send_header("Connection", "close")
+        handler.send_header("X-Accel-Buffering", "no")
+        handler.send_header("Access-Control-Allow-Origin", "*")
+        handler.end_headers()
+        handler.wfile.write("retry: 3000\n: subscribed\n\n".encode('utf-8'))
+        handler.wfile.flush()
+
+        subscriber = _Subscriber(handler.request, pairs, last_event_id)
+        handler.close_connection = True
+        handler.server.detach_request(handler.request)
+        with self._lock:
+            self._pending.append(subscriber)
+        self._wake()
+        return True
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        self._selector = selectors.DefaultSelector()
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+        self._selector.register(self._wake_reader, selectors.EVENT_READ, None)
+        self._last_id = self._read_id = self._exchange_rates_dao.get_last_history_id()
+        threading.Thread(target=self._read_loop, name="rate-stream-reader", daemon=True).start()
+        self._thread = threading.Thread(target=self._run, name="rate-stream", daemon=True)
+        self._thread.start()
+
+    def _events_since(self, last_id):
+        """Yields (event id, pair code, encoded event) for history rows after last_id"""
+        while True:
+            changes = self._exchange_rates_dao.get_history_since(last_id, 500)
+            for change in changes:
+                base = self._currency_dao.get_currency_by_id(change["base_currency_id"])
+                target = self._currency_dao.get_currency_by_id(change["target_currency_id"])
+                if not base or not target:
+                    continue
+                payload = json.dumps({
+                    "baseCurrency": base.code,
+                    "targetCurrency": target.code,
+                    "rate": change["rate"],
+                    "timestamp": format_timestamp(change["changed_at"])
+                }, ensure_ascii=False)
+                data = f"id: {change['id']}\nevent: rate\ndata: {payload}\n\n".encode('utf-8')
+                yield change["id"], base.code + target.code, data
+            if len(changes) < 500:
+                return
+            last_id = changes[-1]["id"]
+
+    # Reader thread: all database reads happen here, never on the selector thread
+
+    def _read_loop(self):
+        while True:
+            job = self._reads.get()
+            try:
+                if job is None:
+                    self._read_new_changes()
+                else:
+                    self._read_replay(*job)
+            except Exception as e:
+                print(f"Error in rate stream: {e}")
+                if job is not None:
+                    self._post(self._replay_failed, job[0])
+
+    def _post(self, function, *args):
+        with self._lock:
+            self._results.append((function, args))
+        self._wake()
+
+    def _read_new_changes(self):
+        # Cleared first, so a write during the read queues another one
+        self._publish_queued = False
+        batch = []
+        for event_id, pair, data in self._events_since(self._read_id):
+            self._read_id = event_id
+            batch.append((event_id, pair, data))
+            if len(batch) == 500:
+                self._post(self._publish, batch)
+                batch = []
+        if batch:
+            self._post(self._publish, batch)
+
+    def _read_replay(self, subscriber, after_id, budget):
+        """
+        Reads the subscriber's missed events after after_id, until they fill
+        budget bytes or replay_batch_rows rows have been scanned
+        """
+        events = []
+        size = 0
+        scanned_to = after_id
+        exhausted = True
+        for scanned, (event_id, pair, data) in enumerate(self._events_since(after_id), 1):
+            if subscriber.pairs is None or pair in subscriber.pairs:
+                if events and size + len(data) > budget:
+                    exhausted = False
+                    break
+                events.append((event_id, data))
+                size += len(data)
+            scanned_to = event_id
+            if scanned >= self._replay_batch_rows:
+                exhausted = False
+                break
+        self._post(self._apply_replay, subscriber, events, scanned_to, exhausted)
+
+    # Selector thread
+
+    def _run(self):
+        last_poll = last_heartbeat = time.monotonic()
+        while True:
+            timeout = min(self._poll_interval, self._heartbeat_interval)
+            for key, events in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while self._wake_reader.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                subscriber = key.data
+                if events & selectors.EVENT_READ:
+                    # Clients never send anything after the request; EOF means they left
+                    try:
+                        if not subscriber.sock.recv(1024):
+                            self._drop(subscriber)
+                            continue
+                    except BlockingIOError:
+                        pass
+                    except OSError:
+                        self._drop(subscriber)
+                        continue
+                if events & selectors.EVENT_WRITE:
+                    self._send(subscriber)
+
+            with self._lock:
+                pending, self._pending = self._pending, []
+                results, self._results = self._results, []
+            for function, args in results:
+                function(*args)
+            for subscriber in pending:
+                subscriber.sock.setblocking(False)
+                self._subscribers[subscriber.sock] = subscriber
+                self._selector.register(subscriber.sock, selectors.EVENT_READ, subscriber)
+                if subscriber.replay_from >= self._last_id:
+                    subscriber.replay_from = None
+                self._send(subscriber)
+
+            now = time.monotonic()
+            if self._dirty or now - last_poll >= self._poll_interval:
+                self._dirty = False
+                last_poll = now
+                if not self._publish_queued:
+                    self._publish_queued = True
+                    self._reads.put(None)
+            if now - last_heartbeat >= self._heartbeat_interval:
+                last_heartbeat = now
+                self._broadcast(None, b": ping\n\n")
+
+    def _publish(self, changes):
+        for event_id, pair, data in changes:
+            self._last_id = event_id
+            self._broadcast(pair, data)
+
+    def _apply_replay(self, subscriber, events, scanned_to, exhausted):
+        """
+        Queues a replay batch. Events past the last broadcast one are left to
+        the live stream, which the subscriber joins once it has caught up.
+        """
+        subscriber.replay_pending = False
+        if self._subscribers.get(subscriber.sock) is not subscriber:
+            return
+        for event_id, data in events:
+            if event_id > self._last_id:
+                break
+            subscriber.buffer += data
+        subscriber.replay_from = self._last_id if exhausted else min(scanned_to, self._last_id)
+        if subscriber.replay_from >= self._last_id:
+            subscriber.replay_from = None
+        self._send(subscriber)
+
+    def _replay_failed(self, subscriber):
+        subscriber.replay_pending = False
+        self._drop(subscriber)
+
+    def _broadcast(self, pair, data):
+        for subscriber in list(self._subscribers.values()):
+            # A replaying subscriber reads this event from the history in turn
+            if subscriber.replay_from is not None:
+                continue
+            if pair is None or subscriber.pairs is None or pair in subscriber.pairs:
+                subscriber.buffer += data
+                self._send(subscriber)
+
+    def _send(self, subscriber):
+        if subscriber.buffer:
+            try:
+                sent = subscriber.sock.send(subscriber.buffer)
+                del subscriber.buffer[:sent]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self._drop(subscriber)
+                return
+        if len(subscriber.buffer) > self._max_buffer_bytes:
+            self.dropped += 1
+            self._drop(subscriber)
+            return
+        # A replay reads its next batch once half of the buffer has drained
+        if (subscriber.replay_from is not None and not subscriber.replay_pending
+                and len(subscriber.buffer) <= self._max_buffer_bytes // 2):
+            subscriber.replay_pending = True
+            self._reads.put((subscriber, subscriber.replay_from, self._max_buffer_bytes - len(subscriber.buffer)))
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if subscriber.buffer else 0)
+        self._selector.modify(subscriber.sock, events, subscriber)
+
+    def _drop(self, subscriber):
+        if self._subscribers.pop(subscriber.sock, None) is None:
+            return
+        try:
+            self._selector.unregister(subscriber.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            subscriber.sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+import time
+
+from server.compression import MIN_COMPRESS_BYTES, CachedBody, brotli, compress, send_body
+from server.conditional import send_not_modified_if_fresh, send_validators
+
+# Files at least this large are streamed from disk with sendfile() instead of kept in memory
+SENDFILE_MIN_BYTES = 256 * 1024
+
+
+class StaticFile:
+    """
+    A file served by the API server itself.
+
+    Small files are read (and passed through rewrite(bytes) -> bytes) once,
+    compressed once per encoding and served from memory; large files without
+    a rewrite go out with sendfile(). The file is stat()ed at most every
+    check_interval seconds and reloaded only when its mtime or size changes.
+    """
+
+    def __init__(self, path, content_type, rewrite=None, check_interval=1.0):
+        self._path = path
+        self._content_type = content_type
+        self._rewrite = rewrite
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = float("-inf")
+        self._stat_key = None
+        # (body or None when streamed, etag, mtime, size), None while the file is missing
+        self._loaded = None
+
+    def _current(self):
+        now = time.monotonic()
+        if now - self._checked_at < self._check_interval:
+            return self._loaded
+        with self._lock:
+            if now - self._checked_at < self._check_interval:
+                return self._loaded
+            try:
+                stat = os.stat(self._path)
+            except FileNotFoundError:
+                self._stat_key = self._loaded = None
+            else:
+                stat_key = (stat.st_mtime_ns, stat.st_size)
+                if stat_key != self._stat_key:
+                    self._loaded = self._load(stat)
+                    self._stat_key = stat_key
+            self._checked_at = now
+            return self._loaded
+
+    def _load(self, stat):
+        if stat.st_size >= SENDFILE_MIN_BYTES and self._rewrite is None:
+            tag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+            return None, f'W/"{tag}"', stat.st_mtime, stat.st_size
+        with open(self._path, "rb") as f:
+            content = f.read()
+        if self._rewrite is not None:
+            content = self._rewrite(content)
+        body = CachedBody(content)
+        if len(body) >= MIN_COMPRESS_BYTES:
+            for encoding in ("br", "gzip") if brotli is not None else ("gzip",):
+                body.variants[encoding] = compress(body, encoding, best=True)
+        return body, f'W/"{hashlib.sha1(content).hexdigest()[:16]}"', stat.st_mtime, len(body)
+
+    def serve(self, handler):
+        """
+        Sends the file (or 304 Not Modified); returns False if it does not exist
+        """
+        loaded = self._current()
+        if loaded is None:
+            return False
+        body, etag, mtime, size = loaded
+        if send_not_modified_if_fresh(handler, etag, mtime):
+            return True
+        if body is None:
+            try:
+                f = open(self._path, "rb")
+            except FileNotFoundError:
+                return False
+        handler.send_response(200)
+        handler.send_header("Content-Type", self._content_type)
+        send_validators(handler, etag, mtime)
+        handler.send_header("Access-Control-Allow-Origin", "*")
+        handler.send_header("Access-Control-Allow-Methods", "GET, POST, PATCH, OPTIONS")
+        handler.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
+        if body is not None:
+            send_body(handler, body)
+            return True
+        with f:
+            handler.send_header("Content-Length", str(size))
+            handler.end_headers()
+            handler.wfile.flush()
+            handler.connection.sendfile(f, 0, size)
+        return True
@@ -1,25 +1,10 @@
 
 import os
-import threading
-import time
-from http.server import HTTPServer, SimpleHTTPRequestHandler
 
-API_PORT = 8000
-FRONTEND_PORT = 3000
+API_PORT = int(os.environ.get("PORT", 8000))
+DB_PATH = os.environ.get("DB_PATH", "currency_exchange.db")
 SERVER_IP = "your external IP"
 
-def start_frontend_server(port):
-    class FrontendHandler(SimpleHTTPRequestHandler):
-        def log_message(self, format, *args):
-            pass  
-
-    try:
-        httpd = HTTPServer(('0.0.0.0', port), FrontendHandler)
-        print(f" Фронтенд сервер запущен на http://{SERVER_IP}:{port}")
-        httpd.serve_forever()
-    except Exception as e:
-        print(f" Ошибка запуска фронтенд сервера: {e}")
-
 def main():
     print("Запуск Currency Exchange API с фронтендом...")
     print("=" * 50)
@@ -32,14 +17,14 @@ def main():
             print(f"  - {file}")
         return
 
-    try:
-        from database_setup import init_database
-        init_database()
-        print("База данных инициализирована")
-    except ImportError:
-        print("Модуль database_setup не найден — возможно, БД уже создана")
-    except Exception as e:
-        print(f"Ошибка инициализации БД: {e}")
+    # Новая БД заполняется начальными данными, существующую myServer только дополняет схемой
+    if not os.path.exists(DB_PATH):
+        try:
+            from database_setup import DatabaseCreator
+            DatabaseCreator(DB_PATH).init_all()
+            print("База данных инициализирована")
+        except Exception as e:
+            print(f"Ошибка инициализации БД: {e}")
 
     def is_port_available(port):
         import socket
@@ -53,24 +38,9 @@ def main():
     if not is_port_available(API_PORT):
         print(f" Порт {API_PORT} уже используется")
         return
-    if not is_port_available(FRONTEND_PORT):
-        print(f" Порт {FRONTEND_PORT} уже используется")
-        return
-
-    print(f"  Используемые порты:")
-    print(f"  API сервер: {API_PORT}")
-    print(f"  Фронтенд:   {FRONTEND_PORT}")
-
-    # Запуск фронтенда в отдельном потоке
-    threading.Thread(
-        target=start_frontend_server,
-        args=(FRONTEND_PORT,),
-        daemon=True
-    ).start()
-
-    time.sleep(2)  
 
-    print(f" Фронтенд: http://{SERVER_IP}:{FRONTEND_PORT}/frontend.html")
+    # frontend.html отдаёт сам API сервер, отдельный сервер для него не нужен
+    print(f" Фронтенд: http://{SERVER_IP}:{API_PORT}/")
     print(f" API: http://{SERVER_IP}:{API_PORT}")
     print("\n Для остановки нажмите Ctrl+C")
     print("=" * 50)
@@ -81,7 +51,7 @@ def main():
     except ImportError as e:
         print(f"Не удалось импортировать myServer.py: {e}")
     except KeyboardInterrupt:
-        print("\n Серверы остановлены")
+        print("\n Сервер остановлен")
 
 if __name__ == '__main__':
     main()
@@ -65,6 +65,19 @@ def test_patch_exchange_rate():
     print(f"Response: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
     print()
 
+def test_post_exchange_rates_bulk():
+    print("=== Тестируем POST /exchangeRates/bulk ===")
+    rows = [
+        {"base": "USD", "target": "EUR", "rate": 0.92},
+        {"base": "EUR", "target": "RUB", "rate": 101.2},
+        {"base": "USD", "target": "XXX", "rate": 1},
+        {"base": "USD", "target": "JPY", "rate": "abc"},
+    ]
+    response = requests.post(f"{BASE_URL}/exchangeRates/bulk", json=rows)
+    print(f"Status: {response.status_code}")
+    print(f"Response: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
+    print()
+
 def test_exchange():
     print("=== Тестируем GET /exchange ===")
     
@@ -86,6 +99,44 @@ def test_exchange():
     print(f"Response: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
     print()
 
+def test_exchange_batch():
+    print("=== Тестируем POST /exchange/batch ===")
+    items = [
+        {"from": "USD", "to": "EUR", "amount": 100},
+        {"from": "EUR", "to": "JPY", "amount": "10.555"},
+        {"from": "USD", "to": "XXX", "amount": 1},
+        {"from": "USD", "to": "EUR", "amount": -5},
+    ]
+    response = requests.post(f"{BASE_URL}/exchange/batch", json=items)
+    print(f"Status: {response.status_code}")
+    print(f"Response: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
+    print()
+
+def test_exchange_matrix():
+    print("=== Тестируем GET /exchangeMatrix ===")
+    response = requests.get(f"{BASE_URL}/exchangeMatrix?codes=USD,EUR,JPY")
+    print(f"Status: {response.status_code}")
+    print(f"Response: {json.dumps(response.json(), indent=2, ensure_ascii=False)}")
+    print()
+
+def test_conditional_get():
+    print("=== Тестируем ETag / If-None-Match ===")
+    response = requests.get(f"{BASE_URL}/exchangeRates")
+    etag = response.headers.get("ETag")
+    print(f"ETag: {etag}, Last-Modified: {response.headers.get('Last-Modified')}")
+    response = requests.get(f"{BASE_URL}/exchangeRates", headers={"If-None-Match": etag})
+    print(f"Status: {response.status_code}")
+    print()
+
+def test_keep_alive():
+    print("=== Тестируем keep-alive ===")
+    with requests.Session() as session:
+        for path in ("/currencies", "/currency/USD", "/exchangeRate/USDEUR", "/nope"):
+            response = session.get(f"{BASE_URL}{path}")
+            print(f"{path}: {response.status_code}, Content-Length: {response.headers.get('Content-Length')}, "
+                  f"Connection: {response.headers.get('Connection', 'keep-alive')}")
+    print()
+
 def test_error_cases():
     print("=== Тестируем обработку ошибок ===")
     
@@ -113,7 +164,12 @@ if __name__ == "__main__":
         test_get_exchange_rate()
         test_post_exchange_rate()
         test_patch_exchange_rate()
+        test_post_exchange_rates_bulk()
         test_exchange()
+        test_exchange_batch()
+        test_exchange_matrix()
+        test_conditional_get()
+        test_keep_alive()
         test_error_cases()
         
     except requests.exceptions.ConnectionError:
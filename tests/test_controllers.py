@@ -0,0 +1,104 @@
+import json
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pytest
+
+
+@pytest.fixture
+def api(tmp_path):
+    """
+    Serves an App on a fresh database and yields request(method, path, body=None) -> (status, json).
+    A str body is sent as a form, anything else as JSON.
+    """
+    import myServer
+    from database_setup import DatabaseCreator
+
+    class _QuietHandler(myServer.MyServer):
+        def log_message(self, format, *args):
+            pass
+
+    db_path = str(tmp_path / "test.db")
+    DatabaseCreator(db_path).init_all()
+    app = myServer.App(db_path)
+    httpd = myServer.make_server(app, ("127.0.0.1", 0), workers=2, queue_size=8, handler_class=_QuietHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    def request(method, path, body=None):
+        if isinstance(body, str):
+            data, content_type = body.encode("utf-8"), "application/x-www-form-urlencoded"
+        else:
+            data, content_type = (json.dumps(body).encode("utf-8") if body is not None else None), "application/json"
+        req = urllib.request.Request(base_url + path, data=data, method=method, headers={"Content-Type": content_type})
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    try:
+        yield request
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        app.close()
+
+
+def test_exchange_batch_matches_single_conversions_item_by_item(api):
+    items = [
+        {"from": "USD", "to": "EUR", "amount": "10.005"},
+        {"from": "USD", "to": "EUR", "amount": "1e30"},
+        {"from": "USD", "to": "XXX", "amount": "1"},
+        {"from": "EUR", "to": "USD", "amount": "2.5"},
+        {"from": "USD", "amount": "1"},
+        "USD",
+        {"from": "usd", "to": "eur", "amount": 123.455},
+        {"from": "USD", "to": "JPY", "amount": "9e25"},
+        {"from": "EUR", "to": "JPY", "amount": "-3"},
+        {"from": "EUR", "to": "JPY", "amount": "7"},
+    ]
+    status, results = api("POST", "/exchange/batch", items)
+    assert status == 200 and len(results) == len(items)
+
+    assert results[1] == {"message": "Invalid amount value", "status": 400}
+    assert results[2] == {"message": "Currency 'XXX' not found", "status": 404}
+    assert results[4] == {"message": "Required parameter 'to' is missing", "status": 400}
+    assert results[5] == {"message": "Item must be an object", "status": 400}
+    # The amount itself fits, its conversion to JPY has too many digits to round
+    assert results[7] == {"message": "Invalid amount value", "status": 400}
+    assert results[8] == {"message": "Invalid amount value", "status": 400}
+
+    for index in (0, 3, 6, 9):
+        item = items[index]
+        query = urllib.parse.urlencode({"from": item["from"], "to": item["to"], "amount": item["amount"]})
+        assert api("GET", f"/exchange?{query}") == (200, results[index])
+    assert results[0]["amount"] == 10.01 and results[0]["convertedAmount"] == 9.1
+    assert results[6]["baseCurrency"]["code"] == "USD" and results[6]["amount"] == 123.46
+    assert api("GET", "/exchange?from=USD&to=EUR&amount=1e30") == (400, {"message": "Invalid amount value"})
+
+
+def test_exchange_matrix_follows_rate_and_currency_changes(api):
+    status, matrix = api("GET", "/exchangeMatrix?codes=usd,EUR,GBP,USD")
+    assert status == 200 and matrix["currencies"] == ["USD", "EUR", "GBP"]
+    # Stored pairs as they are, their reverses inverted, the diagonal 1.0
+    assert matrix["rates"] == [
+        [1.0, 0.91, 0.79],
+        [pytest.approx(1 / 0.91), 1.0, 0.87],
+        [pytest.approx(1 / 0.79), pytest.approx(1 / 0.87), 1.0],
+    ]
+    assert api("GET", "/exchangeMatrix?codes=USD,XXX") == (404, {"message": "Currency 'XXX' not found"})
+
+    status, full = api("GET", "/exchangeMatrix")
+    assert status == 200 and "XTS" not in full["currencies"]
+    assert api("POST", "/currencies", "name=Testing&code=XTS&sign=T")[0] == 201
+    status, full = api("GET", "/exchangeMatrix")
+    xts = full["currencies"].index("XTS")
+    assert [row[xts] for row in full["rates"]] == [1.0 if i == xts else None for i in range(len(full["rates"]))]
+    assert full["rates"][xts] == [1.0 if i == xts else None for i in range(len(full["rates"]))]
+
+    assert api("PATCH", "/exchangeRate/USDEUR", "rate=0.5")[0] == 200
+    status, matrix = api("GET", "/exchangeMatrix?codes=USD,EUR")
+    assert matrix["rates"] == [[1.0, 0.5], [2.0, 1.0]]
@@ -13,13 +13,293 @@ def main():
     print("USD:", usd)
     print("EUR:", eur)
 
-    base_id = usd["id"]
-    target_id = eur["id"]
+    base_id = usd.id
+    target_id = eur.id
 
     rate = 0.91
     exchange_rates_dao.set_exchange_rate(base_id, target_id, rate)
 
     retrieved_rate = exchange_rates_dao.get_exchange_rate(base_id, target_id)
 
-    assert retrieved_rate["rate"] == rate, f"Expected rate {rate}, got {retrieved_rate['rate']}"
+    assert retrieved_rate.rate == rate, f"Expected rate {rate}, got {retrieved_rate.rate}"
     print("Тест прошёл успешно!")
+
+
+def _make_db(tmp_path):
+    from database_setup import DatabaseCreator
+    db_path = str(tmp_path / "test.db")
+    DatabaseCreator(db_path).init_all()
+    return DB(db_path)
+
+
+def test_connections_are_reused(tmp_path):
+    db = _make_db(tmp_path)
+    with db.connection() as first:
+        pass
+    with db.connection() as second:
+        assert second is first
+        assert second.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+        assert second.execute("PRAGMA foreign_keys;").fetchone()[0] == 1
+    db.close()
+
+
+def test_failed_transaction_is_rolled_back(tmp_path):
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    try:
+        with db.transaction() as conn:
+            conn.execute("INSERT INTO Currencies (code, fullname, sign) VALUES ('XTS', 'Test', 'T');")
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    assert currency_dao.get_currency_by_code("XTS") is None
+    try:
+        currency_dao.insert("USD", "Dollar", "$")
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    assert currency_dao.insert("XTS", "Test", "T") > 0
+    db.close()
+
+
+def test_currency_registry_follows_writes(tmp_path):
+    import sqlite3
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    usd = currency_dao.get_currency_by_code("usd")
+    assert currency_dao.get_currency_by_id(usd.id) is usd
+
+    new_id = currency_dao.insert("XTS", "Test", "T")
+    assert currency_dao.get_currency_by_id(new_id).code == "XTS"
+    currency_dao.update_by_code("XTS", "Testing code", "T")
+    assert currency_dao.get_currency_by_code("XTS").fullname == "Testing code"
+
+    # A write from another connection, as another process would make it
+    other = sqlite3.connect(str(tmp_path / "test.db"))
+    other.execute("UPDATE Currencies SET sign = 'US$' WHERE code = 'USD';")
+    other.commit()
+    other.close()
+    assert currency_dao.get_currency_by_code("USD").sign == "US$"
+    db.close()
+
+
+def test_rate_graph_finds_multi_hop_rates(tmp_path):
+    from models.rate_graph import RateGraph
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    ids = [currency_dao.insert(code, code, code) for code in ("XAA", "XBB", "XCC", "XDD")]
+    exchange_rates_dao.insert(ids[0], ids[1], 2.0)
+    exchange_rates_dao.insert(ids[2], ids[1], 4.0)
+
+    graph = RateGraph(exchange_rates_dao, db, max_hops=2)
+    assert graph.get_rate(ids[0], ids[1]) == 2.0
+    assert graph.get_rate(ids[1], ids[0]) == 0.5
+    assert graph.get_rate(ids[0], ids[2]) == 0.5
+    assert graph.get_rate(ids[0], ids[3]) is None
+
+    # A new pair is picked up, but paths longer than max_hops are not used
+    exchange_rates_dao.insert(ids[2], ids[3], 10.0)
+    assert graph.get_rate(ids[2], ids[3]) == 10.0
+    assert graph.get_rate(ids[0], ids[3]) is None
+    exchange_rates_dao.set_exchange_rate(ids[0], ids[1], 8.0)
+    assert graph.get_rate(ids[0], ids[2]) == 2.0
+    assert graph.get_rates_from(ids[0]) == {ids[0]: 1.0, ids[1]: 8.0, ids[2]: 2.0}
+    db.close()
+
+
+def test_historical_rates_read_the_graph_only_for_cross_rates(tmp_path):
+    import time
+    from models.rate_graph import RateGraph
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    ids = [currency_dao.insert(code, code, code) for code in ("XAA", "XBB", "XCC")]
+    exchange_rates_dao.insert(ids[0], ids[1], 2.0)
+    exchange_rates_dao.insert(ids[2], ids[1], 4.0)
+    exchange_rates_dao.insert(ids[1], ids[0], 0.4)
+    then = time.time()
+    time.sleep(0.01)
+    exchange_rates_dao.set_exchange_rate(ids[0], ids[1], 8.0)
+    exchange_rates_dao.set_exchange_rate(ids[2], ids[1], 1.0)
+
+    graph_builds = []
+    get_all_at = exchange_rates_dao.get_all_at
+    exchange_rates_dao.get_all_at = lambda at: graph_builds.append(at) or get_all_at(at)
+    graph = RateGraph(exchange_rates_dao, db)
+    # A stored pair wins over the inverse of its reverse, as in get_rate()
+    assert graph.get_rate_at(ids[0], ids[1], then) == 2.0
+    assert graph.get_rate_at(ids[1], ids[0], then) == 0.4
+    assert graph.get_rate_at(ids[1], ids[2], then) == 0.25
+    assert graph.get_rate_at(ids[1], ids[2], time.time()) == 1.0
+    assert graph.get_rate_at(ids[0], ids[1], 0) is None
+    assert graph_builds == [0]
+    assert graph.get_rate_at(ids[0], ids[2], then) == 0.5
+    assert len(graph_builds) == 2
+    db.close()
+
+
+def test_get_all_with_currencies_matches_separate_lookups(tmp_path):
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    joined = exchange_rates_dao.get_all_with_currencies()
+    rates = exchange_rates_dao.get_all()
+    assert len(joined) == len(rates)
+    for row, rate in zip(joined, rates):
+        assert row.id == rate.id and row.rate == rate.rate
+        assert row.base_currency == currency_dao.get_currency_by_id(rate.base_currency_id)
+        assert row.target_currency == currency_dao.get_currency_by_id(rate.target_currency_id)
+    db.close()
+
+
+def test_keyset_pages_cover_the_filtered_rows_once(tmp_path):
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    usd = currency_dao.get_currency_by_code("USD").id
+    all_rates = exchange_rates_dao.get_all_with_currencies()
+
+    seen, after = [], 0
+    while True:
+        page = exchange_rates_dao.get_page_with_currencies(after, 3, base_ids=[usd])
+        if not page:
+            break
+        seen.extend(page)
+        after = page[-1].id
+    assert seen == [rate for rate in all_rates if rate.base_currency.id == usd]
+
+    currencies = currency_dao.get_all_currencies()
+    assert currency_dao.get_currencies_page(currencies[0].id, 2) == currencies[1:3]
+    assert currency_dao.get_currencies_page(0, 10, {"EUR", "USD", "XXX"}) == \
+        [currency_dao.get_currency_by_code("USD"), currency_dao.get_currency_by_code("EUR")]
+    db.close()
+
+
+def test_version_changes_only_with_relevant_writes(tmp_path):
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    currencies_version = currency_dao.version()[0]
+    rates_version = exchange_rates_dao.version()[0]
+
+    usd = currency_dao.get_currency_by_code("USD")
+    eur = currency_dao.get_currency_by_code("EUR")
+    exchange_rates_dao.set_exchange_rate(usd.id, eur.id, 0.95)
+    assert currency_dao.version()[0] == currencies_version
+    assert exchange_rates_dao.version()[0] != rates_version
+
+    rates_version = exchange_rates_dao.version()[0]
+    currency_dao.update_by_code("USD", "US dollar", "$")
+    assert currency_dao.version()[0] != currencies_version
+    assert exchange_rates_dao.version()[0] != rates_version
+    db.close()
+
+
+def test_version_is_shared_by_every_instance_on_the_file(tmp_path):
+    first = _make_db(tmp_path)
+    second = DB(str(tmp_path / "test.db"), in_memory_replica=True)
+    first_rates, second_rates = ExchangeRatesDAO(first), ExchangeRatesDAO(second)
+    assert first_rates.version() == second_rates.version()
+
+    usd = CurrencyDAO(first).get_currency_by_code("USD")
+    eur = CurrencyDAO(first).get_currency_by_code("EUR")
+    token = first_rates.version()[0]
+    second_rates.set_exchange_rate(usd.id, eur.id, 0.95)
+    assert second_rates.version()[0] != token
+    assert first_rates.version()[0] == second_rates.version()[0]
+
+    CurrencyDAO(first).update_by_code("USD", "US dollar", "$")
+    assert first_rates.version()[0] == second_rates.version()[0]
+    assert CurrencyDAO(first).version()[0] == CurrencyDAO(second).version()[0]
+    token = first_rates.version()[0]
+    first.close()
+    second.close()
+
+    # A restart reads the versions back from the file
+    restarted = DB(str(tmp_path / "test.db"))
+    assert ExchangeRatesDAO(restarted).version()[0] == token
+    restarted.close()
+
+
+def test_upsert_many_reports_created_and_updated_rows(tmp_path):
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    usd = currency_dao.get_currency_by_code("USD").id
+    eur = currency_dao.get_currency_by_code("EUR").id
+    aud = currency_dao.get_currency_by_code("AUD").id
+
+    statuses = exchange_rates_dao.upsert_many([(usd, eur, 0.95), (eur, aud, 1.6), (eur, aud, 1.7)])
+    assert statuses == ["updated", "created", "updated"]
+    assert exchange_rates_dao.get_exchange_rate(usd, eur).rate == 0.95
+    assert exchange_rates_dao.get_exchange_rate(eur, aud).rate == 1.7
+    db.close()
+
+
+def test_history_as_of_lookups(tmp_path):
+    import time
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    usd = currency_dao.get_currency_by_code("USD").id
+    eur = currency_dao.get_currency_by_code("EUR").id
+
+    before_update = time.time()
+    time.sleep(0.01)
+    exchange_rates_dao.set_exchange_rate(usd, eur, 0.5)
+    exchange_rates_dao.set_exchange_rate(usd, eur, 0.5)
+
+    assert exchange_rates_dao.get_exchange_rate_at(usd, eur, before_update)["rate"] == 0.91
+    assert exchange_rates_dao.get_exchange_rate_at(usd, eur, time.time())["rate"] == 0.5
+    assert exchange_rates_dao.get_exchange_rate_at(usd, eur, 0) is None
+    history = exchange_rates_dao.get_history(usd, eur, 0, float("inf"), 100)
+    assert [change["rate"] for change in history] == [0.91, 0.5]
+    rates_then = {(r.base_currency_id, r.target_currency_id): r.rate
+                  for r in exchange_rates_dao.get_all_at(before_update)}
+    assert rates_then[(usd, eur)] == 0.91
+    db.close()
+
+
+def test_candles_follow_rate_changes(tmp_path):
+    db = _make_db(tmp_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    usd = currency_dao.get_currency_by_code("USD").id
+    eur = currency_dao.get_currency_by_code("EUR").id
+    for rate in (2.0, 0.5, 1.0):
+        exchange_rates_dao.set_exchange_rate(usd, eur, rate)
+
+    candles = exchange_rates_dao.get_candles(usd, eur, "1d", 0, float("inf"), 10)
+    assert len(candles) == 1
+    candle = candles[0]
+    assert (candle["open"], candle["high"], candle["low"], candle["close"]) == (0.91, 2.0, 0.5, 1.0)
+    assert candle["count"] == 4
+    assert abs(candle["average"] - 4.41 / 4) < 1e-9
+    db.close()
+
+
+def test_memory_replica_follows_own_and_foreign_writes(tmp_path):
+    from database_setup import DatabaseCreator
+    db_path = str(tmp_path / "test.db")
+    DatabaseCreator(db_path).init_all()
+    db = DB(db_path, in_memory_replica=True)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    usd = CurrencyDAO(db).get_currency_by_code("USD")
+
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA database_list;").fetchone()[2] != db_path
+        assert conn.execute("PRAGMA journal_mode;").fetchone()[0] == "memory"
+    currency_id = CurrencyDAO(db).insert("XTS", "Test", "T")
+    exchange_rates_dao.upsert_many([(usd.id, currency_id, 2.5)])
+    assert exchange_rates_dao.get_exchange_rate(usd.id, currency_id).rate == 2.5
+    with db.connection() as conn:
+        assert conn.execute(
+            "SELECT COUNT(*) FROM ExchangeRateHistory WHERE targetCurrencyId = ?;", (currency_id,)
+        ).fetchone()[0] == 1
+
+    other = DB(db_path)
+    ExchangeRatesDAO(other).upsert_many([(usd.id, currency_id, 3.5)])
+    other.close()
+    assert exchange_rates_dao.get_exchange_rate(usd.id, currency_id).rate == 3.5
+    db.close()
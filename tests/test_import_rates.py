@@ -0,0 +1,122 @@
+import pytest
+
+import import_rates
+from models.db import DB
+from models.currency_dao import CurrencyDAO
+from models.exchange_rates_dao import ExchangeRatesDAO
+
+
+def _make_db_file(tmp_path):
+    from database_setup import DatabaseCreator
+    db_path = str(tmp_path / "test.db")
+    DatabaseCreator(db_path).init_all()
+    return db_path
+
+
+def _stored_rate(db_path, base_code, target_code):
+    db = DB(db_path)
+    try:
+        currency_dao = CurrencyDAO(db)
+        base = currency_dao.get_currency_by_code(base_code)
+        target = currency_dao.get_currency_by_code(target_code)
+        rate = ExchangeRatesDAO(db).get_exchange_rate(base.id, target.id)
+        return rate.rate if rate else None
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Records the number of rows written by each upsert_many transaction"""
+    sizes = []
+    upsert_many = ExchangeRatesDAO.upsert_many
+
+    def recording_upsert_many(self, rows):
+        rows = list(rows)
+        sizes.append(len(rows))
+        return upsert_many(self, rows)
+
+    monkeypatch.setattr(ExchangeRatesDAO, "upsert_many", recording_upsert_many)
+    return sizes
+
+
+def test_import_csv_counts_and_batches(tmp_path, capsys, batches):
+    db_path = _make_db_file(tmp_path)
+    path = tmp_path / "rates.csv"
+    path.write_text(
+        "base,target,rate\n"
+        "USD,EUR,0.5\n"
+        "EUR,AUD,1.6\n"
+        "XXX,USD,1\n"
+        "USD,JPY,abc\n"
+        "usd, cad ,1.4\n"
+        "GBP,USD,-1\n"
+        "EUR,JPY,160\n",
+        encoding="utf-8"
+    )
+
+    import_rates.main([str(path), "--db", db_path, "--batch-size", "2"])
+
+    err = capsys.readouterr().err
+    assert "Line 4 skipped: unknown base currency 'XXX'" in err
+    assert "Line 5 skipped: invalid rate value" in err
+    assert "Line 7 skipped: invalid rate value" in err
+    assert "Done: 7 rows read, 2 created, 2 updated, 3 skipped" in err
+    assert batches == [2, 2]
+    assert _stored_rate(db_path, "USD", "EUR") == 0.5
+    assert _stored_rate(db_path, "EUR", "AUD") == 1.6
+    assert _stored_rate(db_path, "USD", "CAD") == 1.4
+    assert _stored_rate(db_path, "EUR", "JPY") == 160
+    assert _stored_rate(db_path, "GBP", "USD") is None
+
+
+def test_import_ndjson_counts_and_batches(tmp_path, capsys, batches):
+    db_path = _make_db_file(tmp_path)
+    path = tmp_path / "rates.ndjson"
+    path.write_text(
+        '{"base": "USD", "target": "EUR", "rate": 0.7}\n'
+        "\n"
+        "not json\n"
+        '["USD", "EUR", 0.8]\n'
+        '{"base": "EUR", "target": "RUB", "rate": "101.5"}\n'
+        '{"base": "USD", "target": "EUR", "rate": 0.8}\n'
+        '{"base": "USD", "target": "GBP"}\n'
+        '{"base": "JPY", "target": "CAD", "rate": 0.009}\n',
+        encoding="utf-8"
+    )
+
+    import_rates.main([str(path), "--db", db_path, "--batch-size", "3"])
+
+    err = capsys.readouterr().err
+    assert "Line 3 skipped: not a JSON object" in err
+    assert "Line 4 skipped: not a JSON object" in err
+    assert "Line 7 skipped: invalid rate value" in err
+    # The blank line is not counted as a row
+    assert "Done: 7 rows read, 2 created, 2 updated, 3 skipped" in err
+    assert batches == [3, 1]
+    assert _stored_rate(db_path, "USD", "EUR") == 0.8
+    assert _stored_rate(db_path, "EUR", "RUB") == 101.5
+    assert _stored_rate(db_path, "JPY", "CAD") == 0.009
+    assert _stored_rate(db_path, "USD", "GBP") == 0.79
+
+
+def test_import_rejects_bad_batch_size_and_missing_schema(tmp_path, capsys):
+    path = tmp_path / "rates.csv"
+    path.write_text("base,target,rate\nUSD,EUR,0.5\n", encoding="utf-8")
+
+    with pytest.raises(SystemExit) as exc_info:
+        import_rates.main([str(path), "--db", _make_db_file(tmp_path), "--batch-size", "0"])
+    assert exc_info.value.code == 2
+    assert "--batch-size must be at least 1" in capsys.readouterr().err
+
+    missing = tmp_path / "missing.db"
+    with pytest.raises(SystemExit):
+        import_rates.main([str(path), "--db", str(missing)])
+    assert "not found, create it with database_setup.py first" in capsys.readouterr().err
+    assert not missing.exists()
+
+    empty = tmp_path / "empty.db"
+    empty.touch()
+    with pytest.raises(SystemExit):
+        import_rates.main([str(path), "--db", str(empty)])
+    assert "has no Currencies, ExchangeRates, ExchangeRateHistory table(s)" in capsys.readouterr().err
@@ -0,0 +1,653 @@
+import threading
+import time
+import urllib.request
+import urllib.error
+from http.server import BaseHTTPRequestHandler
+
+from server.pool import WorkerPoolHTTPServer
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(0.5)
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start(workers, queue_size):
+    httpd = WorkerPoolHTTPServer(("127.0.0.1", 0), _SlowHandler, workers=workers, queue_size=queue_size)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+
+def test_fast_request_not_blocked_by_slow_one():
+    httpd, base_url = _start(workers=4, queue_size=8)
+    try:
+        slow = threading.Thread(target=urllib.request.urlopen, args=(base_url + "/slow",))
+        slow.start()
+        time.sleep(0.05)
+        started = time.monotonic()
+        with urllib.request.urlopen(base_url + "/fast") as response:
+            assert response.read() == b"ok"
+        assert time.monotonic() - started < 0.4
+        slow.join()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_full_queue_is_rejected_with_503():
+    httpd, base_url = _start(workers=1, queue_size=1)
+    try:
+        busy = [threading.Thread(target=urllib.request.urlopen, args=(base_url + "/slow",)) for _ in range(2)]
+        for thread in busy:
+            thread.start()
+            time.sleep(0.05)
+        try:
+            urllib.request.urlopen(base_url + "/fast")
+            assert False, "expected 503"
+        except urllib.error.HTTPError as e:
+            assert e.code == 503
+        for thread in busy:
+            thread.join()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_idle_keep_alive_connections_do_not_hold_workers(tmp_path):
+    import http.client
+    import socket
+    import myServer
+    from database_setup import DatabaseCreator
+
+    db_path = str(tmp_path / "test.db")
+    DatabaseCreator(db_path).init_all()
+
+    class _QuietHandler(myServer.MyServer):
+        timeout = 1.0
+        max_requests = 3
+
+        def log_message(self, format, *args):
+            pass
+
+    def read_until_closed(sock):
+        received = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return received
+            received += chunk
+
+    app = myServer.App(db_path)
+    httpd = myServer.make_server(app, ("127.0.0.1", 0), workers=2, queue_size=8, handler_class=_QuietHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    port = httpd.server_address[1]
+    idle = []
+    silent = []
+    try:
+        for _ in range(httpd.workers + 2):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/currency/USD")
+            response = conn.getresponse()
+            body = response.read()
+            assert response.status == 200
+            assert int(response.headers["Content-Length"]) == len(body)
+            assert response.headers["Connection"] is None
+            idle.append(conn)
+        silent = [socket.create_connection(httpd.server_address, timeout=5) for _ in range(httpd.workers)]
+
+        started = time.monotonic()
+        fresh = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        fresh.request("GET", "/currency/USD")
+        assert fresh.getresponse().read() == body
+        assert time.monotonic() - started < 0.5
+        fresh.close()
+
+        # The idle connection is still served, and closed after max_requests
+        sock = idle[0].sock
+        idle[0].request("GET", "/currencies")
+        response = idle[0].getresponse()
+        response.read()
+        assert response.status == 200 and idle[0].sock is sock
+        idle[0].request("OPTIONS", "/currencies", body=b"ignored")
+        response = idle[0].getresponse()
+        response.read()
+        assert response.headers["Connection"] == "close" and idle[0].sock is None
+
+        # Pipelined requests are answered in order on one connection
+        client = socket.create_connection(httpd.server_address, timeout=5)
+        client.sendall(b"GET /currency/USD HTTP/1.1\r\nHost: test\r\n\r\n"
+                       b"GET /currency/EUR HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n")
+        received = read_until_closed(client)
+        client.close()
+        assert received.count(b"HTTP/1.1 200") == 2
+        assert received.index(b'"USD"') < received.index(b'"EUR"')
+        assert b"Connection: close" in received
+
+        # HTTP/1.0 is closed after the response unless it asks for keep-alive
+        client = socket.create_connection(httpd.server_address, timeout=5)
+        client.sendall(b"GET /currency/USD HTTP/1.0\r\nConnection: keep-alive\r\n\r\n"
+                       b"GET /currency/USD HTTP/1.0\r\n\r\n")
+        received = read_until_closed(client)
+        client.close()
+        first, second = received.split(b"HTTP/1.1 200 OK\r\n")[1:]
+        assert b"Connection: keep-alive" in first and b"Connection: close" in second
+        head, _, rest = second.partition(b"\r\n\r\n")
+        assert b"Content-Length: %d" % len(rest) in head and rest == body
+
+        # Connections that stay idle past the timeout are closed by the server
+        for sock in silent:
+            assert read_until_closed(sock) == b""
+    finally:
+        for conn in idle:
+            conn.close()
+        for sock in silent:
+            sock.close()
+        httpd.shutdown()
+        httpd.server_close()
+        app.close()
+
+
+def test_expect_100_continue_gets_interim_and_final_response(tmp_path):
+    import json
+    import socket
+    import myServer
+    from database_setup import DatabaseCreator
+
+    db_path = str(tmp_path / "test.db")
+    DatabaseCreator(db_path).init_all()
+
+    class _QuietHandler(myServer.MyServer):
+        def log_message(self, format, *args):
+            pass
+
+    app = myServer.App(db_path)
+    httpd = myServer.make_server(app, ("127.0.0.1", 0), workers=2, queue_size=8, handler_class=_QuietHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        body = json.dumps([{"from": "USD", "to": "EUR", "amount": "10"}]).encode("utf-8")
+        with socket.create_connection(httpd.server_address, timeout=5) as sock:
+            sock.sendall(
+                b"POST /exchange/batch HTTP/1.1\r\nHost: localhost\r\n"
+                b"Content-Type: application/json\r\nExpect: 100-continue\r\n"
+                b"Connection: close\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n"
+            )
+            interim = b""
+            while not interim.endswith(b"\r\n\r\n"):
+                chunk = sock.recv(1)
+                assert chunk, "connection closed before 100 Continue"
+                interim += chunk
+            assert interim.startswith(b"HTTP/1.1 100 ")
+            assert b"Connection" not in interim
+
+            sock.sendall(body)
+            received = b""
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                received += chunk
+        head, _, payload = received.partition(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.1 200 ")
+        assert b"Connection: close" in head
+        assert json.loads(payload)[0]["convertedAmount"] == 9.1
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        app.close()
+
+
+def test_response_cache_drops_only_dependent_entries(tmp_path):
+    from database_setup import DatabaseCreator
+    from models.db import DB
+    from server.response_cache import ResponseCache
+
+    db_path = str(tmp_path / "test.db")
+    DatabaseCreator(db_path).init_all()
+    db = DB(db_path)
+    cache = ResponseCache(db, max_entries=2)
+    cache.get_or_build(("currencies",), lambda: (b"currencies", {"currencies"}))
+    cache.get_or_build(("rate", 1, 2), lambda: (b"USDEUR", {("rate", 1, 2), ("currency", "USD")}))
+
+    db.notify_write("ExchangeRates", (1, 3))
+    assert cache.get(("currencies",)) == b"currencies"
+    assert cache.get(("rate", 1, 2)) == b"USDEUR"
+    db.notify_write("Currencies", "USD")
+    assert cache.get(("currencies",)) is None
+    assert cache.get(("rate", 1, 2)) is None
+
+    for i in range(3):
+        cache.get_or_build(("rate", 1, i), lambda: (b"x", set()))
+    assert cache.get(("rate", 1, 0)) is None
+    assert cache.get(("rate", 1, 2)) == b"x"
+
+    # A change by another process may touch anything
+    db.notify_write(None)
+    assert cache.get(("rate", 1, 1)) is None and cache.get(("rate", 1, 2)) is None
+    db.close()
+
+
+def test_rate_stream_pushes_filtered_changes(tmp_path):
+    import socket
+    from database_setup import DatabaseCreator
+    from models.db import DB
+    from models.currency_dao import CurrencyDAO
+    from models.exchange_rates_dao import ExchangeRatesDAO
+    from server.pool import DetachableHTTPServer
+    from server.sse import RateStream
+
+    db_path = str(tmp_path / "test.db")
+    DatabaseCreator(db_path).init_all()
+    db = DB(db_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    xaa = currency_dao.insert("XAA", "Test A", "A")
+    xbb = currency_dao.insert("XBB", "Test B", "B")
+    usd = currency_dao.get_currency_by_code("USD").id
+    stream = RateStream(exchange_rates_dao, currency_dao, db)
+
+    class _StreamHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            stream.subscribe(self, {"XAAXBB"})
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = DetachableHTTPServer(("127.0.0.1", 0), _StreamHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    client = socket.create_connection(httpd.server_address, timeout=5)
+    try:
+        client.sendall(b"GET /stream/rates HTTP/1.1\r\nHost: test\r\n\r\n")
+        received = b""
+        while b": subscribed\n\n" not in received:
+            received += client.recv(4096)
+        assert b"text/event-stream" in received
+
+        exchange_rates_dao.insert(usd, xaa, 90.0)
+        exchange_rates_dao.insert(xaa, xbb, 0.9)
+        while b"\n\n" not in received.split(b": subscribed\n\n", 1)[1]:
+            received += client.recv(4096)
+        event = received.split(b": subscribed\n\n", 1)[1]
+        assert b"event: rate\n" in event
+        assert b'"baseCurrency": "XAA", "targetCurrency": "XBB", "rate": 0.9' in event
+        assert b"USD" not in event
+        assert stream.client_count == 1
+    finally:
+        client.close()
+        httpd.shutdown()
+        httpd.server_close()
+        db.close()
+
+
+def test_rate_stream_replays_long_history_within_the_buffer(tmp_path):
+    import re
+    import socket
+    from database_setup import DatabaseCreator
+    from models.db import DB
+    from models.currency_dao import CurrencyDAO
+    from models.exchange_rates_dao import ExchangeRatesDAO
+    from server.pool import DetachableHTTPServer
+    from server.sse import RateStream
+
+    db_path = str(tmp_path / "test.db")
+    DatabaseCreator(db_path).init_all()
+    db = DB(db_path)
+    currency_dao = CurrencyDAO(db)
+    exchange_rates_dao = ExchangeRatesDAO(db)
+    xaa = currency_dao.insert("XAA", "Test A", "A")
+    xbb = currency_dao.insert("XBB", "Test B", "B")
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO ExchangeRateHistory (baseCurrencyId, targetCurrencyId, rate, changedAt) VALUES (?, ?, ?, ?);",
+            [(xaa, xbb, i, 1e9 + i) for i in range(1, 5001)]
+        )
+    stream = RateStream(exchange_rates_dao, currency_dao, db, max_buffer_bytes=8192)
+
+    class _StreamHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # Kept small so that the replay backlog stays in the stream's own buffer
+            self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            last_event_id = self.headers.get("Last-Event-ID")
+            stream.subscribe(self, None, int(last_event_id) if last_event_id else None)
+
+        def log_message(self, format, *args):
+            pass
+
+    def subscribe(headers=b""):
+        client = socket.socket()
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        client.settimeout(5)
+        client.connect(httpd.server_address)
+        client.sendall(b"GET /stream/rates HTTP/1.1\r\nHost: test\r\n" + headers + b"\r\n")
+        received = b""
+        while b": subscribed\n\n" not in received:
+            received += client.recv(4096)
+        return client, received.split(b": subscribed\n\n", 1)[1]
+
+    httpd = DetachableHTTPServer(("127.0.0.1", 0), _StreamHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    live = replaying = None
+    try:
+        live, live_received = subscribe()
+        # Reconnects from the start of a history far larger than the buffer and does not read
+        replaying, replayed = subscribe(b"Last-Event-ID: 0\r\n")
+        time.sleep(0.2)
+
+        started = time.monotonic()
+        exchange_rates_dao.insert(xbb, xaa, 1.25)
+        while b"\n\n" not in live_received:
+            live_received += live.recv(4096)
+        assert time.monotonic() - started < 0.5
+        assert b'"baseCurrency": "XBB", "targetCurrency": "XAA", "rate": 1.25' in live_received
+        last_id = exchange_rates_dao.get_last_history_id()
+        assert stream.dropped == 0 and stream.client_count == 2
+
+        # The replay resumes as the client reads: every event once, in order
+        while b"id: %d\n" % last_id not in replayed:
+            replayed += replaying.recv(65536)
+        ids = [int(event_id) for event_id in re.findall(rb"^id: (\d+)$", replayed, re.M)]
+        assert ids == list(range(1, last_id + 1))
+        assert stream.dropped == 0
+    finally:
+        for client in (live, replaying):
+            if client is not None:
+                client.close()
+        httpd.shutdown()
+        httpd.server_close()
+        db.close()
+
+
+def test_router_matches_patterns_and_reports_allowed_methods():
+    from server.router import MethodNotAllowed, NotFound, Router
+
+    router = Router()
+    router.add("GET", "/exchangeRates", "list")
+    router.add("GET", "/exchangeRate/{base:3}{target:3}", "get")
+    router.add("PATCH", "/exchangeRate/{base:3}{target:3}", "patch")
+    router.add("GET", "/exchangeRate/{pair}", "invalid")
+    router.add("GET", "/exchange", "exchange")
+
+    assert router.resolve("GET", "/exchangeRate/USDEUR?x=1") == ("get", {"base": "USD", "target": "EUR"}, {"x": ["1"]})
+    assert router.resolve("GET", "/exchangeRate/USDE")[:2] == ("invalid", {"pair": "USDE"})
+    assert router.resolve("GET", "/exchangeRates?codes=USD")[0] == "list"
+    assert router.resolve("GET", "/exchange?from=USD&to=EUR")[2] == {"from": ["USD"], "to": ["EUR"]}
+    for path in ("/exchangeFoo", "/exchangeRate/USDEUR/extra"):
+        try:
+            router.resolve("GET", path)
+            assert False, f"expected NotFound for {path}"
+        except NotFound:
+            pass
+    try:
+        router.resolve("DELETE", "/exchangeRate/USDEUR")
+        assert False, "expected MethodNotAllowed"
+    except MethodNotAllowed as e:
+        assert e.allowed == ["GET", "PATCH"]
+
+
+def test_compression_negotiation_and_cached_variants():
+    import gzip
+    import io
+    from server import compression
+    from server.compression import CachedBody, choose_encoding, send_body
+
+    assert choose_encoding(None) is None
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("deflate, gzip;q=0.5") == "gzip"
+    assert choose_encoding("*") == ("br" if compression.brotli else "gzip")
+
+    class _Handler:
+        def __init__(self, accept_encoding):
+            self.headers = {"Accept-Encoding": accept_encoding}
+            self.sent = {}
+            self.wfile = io.BytesIO()
+
+        def send_header(self, name, value):
+            self.sent[name] = value
+
+        def end_headers(self):
+            pass
+
+    body = CachedBody(b'{"rate": 0.92}' * 200)
+    handler = _Handler("gzip")
+    send_body(handler, body)
+    assert handler.sent["Content-Encoding"] == "gzip"
+    assert int(handler.sent["Content-Length"]) == len(handler.wfile.getvalue()) < len(body)
+    assert gzip.decompress(handler.wfile.getvalue()) == body
+    assert body.variants["gzip"] == handler.wfile.getvalue()
+    # Cached API bodies are rebuilt after writes, so they get the moderate level
+    assert body.variants["gzip"] == compression.compress(body, "gzip")
+
+    handler = _Handler("gzip")
+    send_body(handler, b"{}")
+    assert "Content-Encoding" not in handler.sent
+    assert handler.wfile.getvalue() == b"{}"
+
+
+def test_static_file_is_rewritten_once_and_reloaded_on_change(tmp_path):
+    import os
+    from http.server import HTTPServer
+    from server import static
+    from server.static import StaticFile
+
+    page = tmp_path / "page.html"
+    page.write_bytes(b"<p>API = 'your url'</p>" * 100)
+    big = tmp_path / "big.bin"
+    big.write_bytes(os.urandom(static.SENDFILE_MIN_BYTES + 1))
+    rewrites = []
+
+    def rewrite(content):
+        rewrites.append(content)
+        return content.replace(b"your url", b"origin")
+
+    files = {
+        "/": StaticFile(str(page), "text/html; charset=utf-8", rewrite=rewrite, check_interval=0),
+        "/big.bin": StaticFile(str(big), "application/octet-stream", check_interval=0),
+    }
+
+    class _StaticHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            files[self.path].serve(self)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = HTTPServer(("127.0.0.1", 0), _StaticHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    try:
+        for _ in range(2):
+            with urllib.request.urlopen(base_url + "/") as response:
+                assert response.read() == b"<p>API = 'origin'</p>" * 100
+                etag = response.headers["ETag"]
+        assert len(rewrites) == 1
+        try:
+            urllib.request.urlopen(urllib.request.Request(base_url + "/", headers={"If-None-Match": etag}))
+            assert False, "expected 304"
+        except urllib.error.HTTPError as e:
+            assert e.code == 304
+            assert e.headers["Vary"] == "Accept-Encoding"
+
+        page.write_bytes(b"<p>changed</p>")
+        os.utime(page, ns=(0, 10 ** 9))
+        with urllib.request.urlopen(base_url + "/") as response:
+            assert response.read() == b"<p>changed</p>"
+            assert response.headers["ETag"] != etag
+
+        with urllib.request.urlopen(base_url + "/big.bin") as response:
+            assert response.read() == big.read_bytes()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_metrics_sum_thread_shards_into_prometheus_text():
+    from server.metrics import Metrics
+
+    metrics = Metrics(buckets=(0.01, 0.1))
+    metrics.describe("requests_total", "counter", "Requests")
+    metrics.describe("latency_seconds", "histogram", "Latency")
+    metrics.add_callback("cache_hits_total", "counter", "Hits", lambda: [((("cache", "response"),), 7)])
+
+    def record():
+        for _ in range(1000):
+            metrics.inc("requests_total", (("route", "a"),))
+        metrics.observe("latency_seconds", (("route", "a"),), 0.05)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.observe("latency_seconds", (("route", "a"),), 0.005)
+
+    text = metrics.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="a"} 4000' in text
+    assert 'latency_seconds_bucket{route="a",le="0.01"} 1' in text
+    assert 'latency_seconds_bucket{route="a",le="0.1"} 5' in text
+    assert 'latency_seconds_bucket{route="a",le="+Inf"} 5' in text
+    assert 'latency_seconds_count{route="a"} 5' in text
+    assert 'cache_hits_total{cache="response"} 7' in text
+
+
+def test_profiler_aggregates_runs_per_route():
+    import json
+    from server.profiling import RequestProfiler
+
+    def encode(n):
+        return [json.dumps({"rate": i}) for i in range(n)]
+
+    profiler = RequestProfiler(sample_rate=1.0)
+    for _ in range(2):
+        profiler.run("handle_encode", encode, 100)
+    profiler.run("handle_other", len, "x")
+
+    assert profiler.routes() == ["handle_encode", "handle_other"]
+    text = profiler.render("text", "handle_encode").decode()
+    assert "(encode)" in text and "200" in text
+    collapsed = profiler.render("collapsed", "handle_encode").decode()
+    assert any(line.startswith("encode (") and ";dumps (" in line for line in collapsed.splitlines())
+    profiler.reset()
+    assert profiler.render("text") is None
+
+
+def test_serializers_match_json_dumps_of_the_api_dicts():
+    import json
+    from controllers.serializers import currencies_to_json, currency_to_dict, exchange_rates_to_json
+    from models.records import Currency, ExchangeRateWithCurrencies
+
+    usd = Currency(1, "USD", "United States dollar", "$")
+    odd = Currency(2, "XTS", 'Quote " back\\slash\ttab Ünï  ', "¤\x01")
+    rates = [
+        ExchangeRateWithCurrencies(1, 0.1 + 0.2, usd, odd),
+        ExchangeRateWithCurrencies(2, 3, odd, usd),
+        ExchangeRateWithCurrencies(3, 1e-7, usd, odd),
+    ]
+
+    def rate_dict(rate):
+        return {
+            "id": rate.id,
+            "baseCurrency": currency_to_dict(rate.base_currency),
+            "targetCurrency": currency_to_dict(rate.target_currency),
+            "rate": rate.rate,
+        }
+
+    expected = json.dumps([currency_to_dict(usd), currency_to_dict(odd)], ensure_ascii=False).encode("utf-8")
+    assert currencies_to_json([usd, odd]) == expected
+    expected = json.dumps([rate_dict(rate) for rate in rates], ensure_ascii=False).encode("utf-8")
+    assert exchange_rates_to_json(rates) == expected
+    assert currencies_to_json([]) == exchange_rates_to_json([]) == b"[]"
+
+
+def test_benchmark_report_and_baseline_comparison():
+    from benchmark import compare, parse_mix, summarize
+
+    assert parse_mix("currencies=1,exchange=3,create_rate=0") == {"currencies": 1.0, "exchange": 3.0}
+    samples = {
+        "currencies": [(ms / 1000, True) for ms in range(1, 101)],
+        "exchange": [(0.01, True), (0.02, False)],
+    }
+    results = summarize(samples, duration=2.0)
+    currencies = results["endpoints"]["currencies"]
+    assert (currencies["p50_ms"], currencies["p95_ms"], currencies["p99_ms"]) == (50.0, 95.0, 99.0)
+    assert currencies["throughput"] == 50.0 and results["throughput"] == 51.0
+
+    baseline = summarize({"currencies": samples["currencies"]}, duration=2.0)
+    assert compare(results, baseline) == ["exchange: 1 of 2 requests failed"]
+    baseline["endpoints"]["currencies"]["p95_ms"] = 50.0
+    baseline["throughput"] = 100.0
+    regressions = compare(results, baseline)
+    assert any(r.startswith("currencies: p95_ms") for r in regressions)
+    assert any(r.startswith("total: throughput") for r in regressions)
+
+
+_PREFORK_SCRIPT = """
+import os, sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from server.prefork import PreforkServer
+
+class PidHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = str(os.getpid()).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(listener):
+    httpd = HTTPServer(listener.getsockname(), PidHandler, bind_and_activate=False)
+    httpd.socket = listener
+    httpd.serve_forever()
+
+PreforkServer(("127.0.0.1", int(sys.argv[1])), serve, processes=2, restart_delay=0.1).serve_forever()
+"""
+
+
+def test_prefork_workers_share_the_port_and_are_restarted():
+    import os
+    import signal
+    import socket
+    import subprocess
+    import sys
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    supervisor = subprocess.Popen([sys.executable, "-c", _PREFORK_SCRIPT, str(port)], cwd=root,
+                                  stderr=subprocess.DEVNULL)
+
+    def worker_pids():
+        pids = set()
+        deadline = time.monotonic() + 10
+        while len(pids) < 2 and time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=2) as response:
+                    pids.add(int(response.read()))
+            except OSError:
+                time.sleep(0.05)
+        return pids
+
+    try:
+        pids = worker_pids()
+        assert len(pids) == 2 and supervisor.pid not in pids
+        crashed = pids.pop()
+        os.kill(crashed, signal.SIGKILL)
+        time.sleep(0.3)
+        restarted = worker_pids()
+        assert len(restarted) == 2 and crashed not in restarted
+    finally:
+        supervisor.terminate()
+        assert supervisor.wait(timeout=10) == 0